@@ -0,0 +1,151 @@
+"""
+Variante ASGI de los endpoints /cxml y /send_status de app.py (Flask).
+
+El event loop solo lee el cuerpo y escribe la respuesta; el trabajo bloqueante va a
+executors acotados:
+  - validación DTD (lxml) -> _VALIDATE_POOL (hilos)
+  - escritura en BD       -> _DB_POOL, del tamaño del pool de conexiones, para que
+                             ningún hilo quede esperando conexión
+Así un proceso mantiene muchas conexiones de proveedores abiertas a la vez.
+
+Ejecutar (desde api/):
+  uvicorn asgi_app:app --host 0.0.0.0 --port 8001
+"""
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import app as flask_api   # api/app.py: validate_cxml, make_cxml_status, update_status
+from db import POOL_SIZE, pool_stats
+
+VALIDATE_WORKERS = int(os.environ.get("EXAMIN_ASGI_VALIDATE_WORKERS", str(os.cpu_count() or 4)))
+DB_WORKERS       = int(os.environ.get("EXAMIN_ASGI_DB_WORKERS", str(POOL_SIZE)))
+MAX_BODY_BYTES   = int(os.environ.get("EXAMIN_ASGI_MAX_BODY_MB", "200")) * 1024 * 1024
+
+_VALIDATE_POOL = ThreadPoolExecutor(max_workers=VALIDATE_WORKERS, thread_name_prefix="cxml-validate")
+_DB_POOL       = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="cxml-db")
+
+XML_HEADERS  = [(b"content-type", b"application/xml")]
+JSON_HEADERS = [(b"content-type", b"application/json")]
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            raise _BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _respond(send, status: int, body: bytes, headers=XML_HEADERS):
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers + [(b"content-length", str(len(body)).encode("ascii"))]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _status_xml(code: int, text: str, message: str) -> bytes:
+    return flask_api.make_cxml_status(code, text, message)
+
+
+async def receive_cxml(body: bytes):
+    if not body:
+        return 406, _status_xml(406, "Not Acceptable", "Empty body: expected cXML")
+
+    loop = asyncio.get_running_loop()
+    ok, err = await loop.run_in_executor(_VALIDATE_POOL, flask_api.validate_cxml, body)
+    if ok:
+        return 201, _status_xml(201, "Accepted", "Acknowledged")
+    return 406, _status_xml(406, "Not Acceptable", f"Invalid Document:{err}")
+
+
+async def send_status(body: bytes):
+    if not body:
+        return 406, _status_xml(406, "Not Acceptable", "Missing JSON payload")
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    # JSON mal formado o que no es un objeto ([1], "x", 3...): 400 como Flask con get_json()
+    if not isinstance(data, dict):
+        return 400, _status_xml(400, "Bad Request", "Invalid JSON payload: expected an object")
+    if not data:
+        return 406, _status_xml(406, "Not Acceptable", "Missing JSON payload")
+
+    status_code = data.get("status_code")
+    invoice_id = data.get("invoice_id")
+    status = data.get("status")
+    if not invoice_id or not status_code:
+        return 406, _status_xml(406, "Not Acceptable", "Missing required fields: invoice_id or status_code")
+
+    df = pd.DataFrame([{
+        "InvoiceID": invoice_id,
+        "invoiceDate": datetime.now().date().isoformat()
+    }])
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(_DB_POOL, lambda: flask_api.update_status(status_code=status_code,
+                                                                            description=status, df=df))
+    except Exception as e:
+        return 406, _status_xml(406, "Not Acceptable", f"Error: {str(e)}")
+    return 201, _status_xml(201, "Accepted", f"Status updated for invoice {invoice_id}")
+
+
+_ROUTES = {
+    ("POST", "/cxml"):        receive_cxml,
+    ("POST", "/send_status"): send_status,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _VALIDATE_POOL.shutdown(wait=False)
+            _DB_POOL.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "GET" and path == "/pool_stats":
+        body = json.dumps(pool_stats(flask_api.DB_URL)).encode("utf-8")
+        return await _respond(send, 200, body, JSON_HEADERS)
+
+    handler = _ROUTES.get((method, path))
+    if handler is None:
+        return await _respond(send, 404, b"Not Found", [(b"content-type", b"text/plain")])
+
+    try:
+        body = await _read_body(receive)
+    except _BodyTooLarge:
+        return await _respond(send, 413, _status_xml(413, "Request Entity Too Large", "Body too large"))
+
+    status, payload = await handler(body)
+    await _respond(send, status, payload)
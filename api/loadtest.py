@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga local de POST /cxml: requests/s y latencias p50/p99.
+
+Cliente HTTP/1.1 mínimo sobre asyncio (keep-alive, sin dependencias externas):
+`--concurrency` conexiones envían el mismo cXML en bucle hasta completar `--requests`.
+
+Comparar Flask (app.py) contra ASGI (asgi_app.py):
+  python app.py                                   # :8000
+  uvicorn asgi_app:app --port 8001                # :8001
+  python loadtest.py --url http://127.0.0.1:8000/cxml --url http://127.0.0.1:8001/cxml \
+      --file "../Sample cXML/172639012.xml" --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def _read_response(reader) -> int:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("conexión cerrada por el servidor")
+    status = int(status_line.split()[1])
+    length, chunked, close = 0, False, False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value:
+            chunked = True
+        elif name == "connection" and value == "close":
+            close = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return -status if close else status
+
+
+async def _worker(url, body: bytes, counter: dict, latencies: list, statuses: dict):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    request = (f"POST {parts.path or '/'} HTTP/1.1\r\n"
+               f"Host: {parts.netloc}\r\n"
+               "Content-Type: application/xml\r\n"
+               f"Content-Length: {len(body)}\r\n"
+               "Connection: keep-alive\r\n\r\n").encode("latin-1") + body
+    reader = writer = None
+    while counter["left"] > 0:
+        counter["left"] -= 1
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        t0 = time.perf_counter()
+        try:
+            writer.write(request)
+            await writer.drain()
+            status = await _read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+            writer.close()
+            reader = writer = None
+            continue
+        latencies.append(time.perf_counter() - t0)
+        if status < 0:                       # el servidor pidió cerrar (p.ej. Werkzeug)
+            status = -status
+            writer.close()
+            reader = writer = None
+        statuses[status] = statuses.get(status, 0) + 1
+    if writer is not None:
+        writer.close()
+
+
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+async def run(url: str, body: bytes, total: int, concurrency: int) -> dict:
+    counter = {"left": total}
+    latencies, statuses = [], {}
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_worker(url, body, counter, latencies, statuses) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    lat = sorted(latencies)
+    return {
+        "url": url,
+        "requests": len(lat),
+        "seconds": elapsed,
+        "rps": len(lat) / elapsed if elapsed else 0.0,
+        "p50_ms": _pct(lat, 50) * 1000,
+        "p99_ms": _pct(lat, 99) * 1000,
+        "mean_ms": statistics.fmean(lat) * 1000 if lat else float("nan"),
+        "statuses": statuses,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga de POST /cxml (Flask vs ASGI)")
+    ap.add_argument("--url", action="append", required=True, help="Endpoint(s) a medir; repetir para comparar")
+    ap.add_argument("--file", required=True, help="cXML a enviar")
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--warmup", type=int, default=50, help="Peticiones previas descartadas")
+    args = ap.parse_args()
+
+    with open(args.file, "rb") as f:
+        body = f.read()
+
+    print(f"{'url':<40} {'req':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  status")
+    for url in args.url:
+        if args.warmup:
+            asyncio.run(run(url, body, args.warmup, min(args.concurrency, args.warmup)))
+        r = asyncio.run(run(url, body, args.requests, args.concurrency))
+        print(f"{r['url']:<40} {r['requests']:>6} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}  {r['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,28 @@
 import requests
+from requests.adapters import HTTPAdapter
+import argparse
+import copy
+import io
+import os
+import gzip
+import queue
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from xml.dom import minidom
 from xml.etree.ElementTree import tostring
 import pandas as pd
 import xml.etree.ElementTree as ET
 import unicodedata
 from typing import Dict, Optional
-from db import get_connection
+from db import get_connection, dispose_engines
+from cxml_cache import CxmlCache, blob_path, sheets_digest
+from mime_package import package_cxml
 from sqlalchemy import text
 import re
 import numpy as np
+from functools import lru_cache
 
 
 DOCTYPE = '<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.066/InvoiceDetail.dtd">'
@@ -17,8 +30,52 @@ DOCTYPE = '<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.066/Invoi
 CXML_DTD = '<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.045/InvoiceDetail.dtd">'
 
 DOCTYPE = '<!DOCTYPE cXML SYSTEM "http://xml.cxml.org/schemas/cXML/1.2.066/InvoiceDetail.dtd">'
+NS_DS    = "http://www.w3.org/2000/09/xmldsig#"
+NS_XADES = "http://uri.etsi.org/01903/v1.3.2#"
+ET.register_namespace("ds", NS_DS)
+ET.register_namespace("xades", NS_XADES)
 EXCEL_PATH = "C:/Users/crist/Downloads/cxml_template_extended.xlsx" 
 _TABLE_NAME_RE = re.compile(r"^[A-Za-z0-9_\.]+$")  # permite schema.table también
+ITEMS_INV_DATE = '20251010'          # fecha usada como taxPointDate de las líneas
+_ITEMS_PLACEHOLDER = "cXMLItemsPlaceholder"   # marcador de build_cxml_for_invoice(defer_items=True)
+DETAIL_COLUMNS = ['invoice_curr', 'invoice_amount','discount_amount','add_comments','invoice_id']
+
+# Columnas y tipos por tabla. load_data/iter_load_data solo piden estas columnas
+# (en vez de SELECT *) y las decodifican una vez a tipos compactos:
+#   - "category" para monedas/estados (pocas variantes repetidas en millones de filas)
+#   - "Int64" para IDs (entero con nulos; sin pasar por float)
+#   - "datetime64[ns]" para fechas
+#   - "float64" para los importes de good_to_pay: son informativos, los importes que
+#     se escriben en el cXML salen de invoice_detail, que conserva el Decimal del driver
+#   - None: se deja el tipo que devuelve el driver
+TABLE_SCHEMAS = {
+    "good_to_pay": {
+        "invoice_id":           "Int64",
+        "invoice_date":         "datetime64[ns]",
+        "business_date":        "datetime64[ns]",
+        "invoice_curr":         "category",
+        "net_invoice_amount":   "float64",
+        "gross_invoice_amount": "float64",
+        "record_status":        "category",
+        "record_active_ind":    "category",
+        "product_type":         "category",
+        "product_sub_type":     "category",
+        "party_invoice_ref_no": None,
+        "party_invoice_name":   None,
+        "trading_account_id":   None,
+        "vendor_id":            None,
+        "attachment_id":        None,
+        "invoice_period":       None,
+        "payment_id":           None,
+    },
+    "invoice_detail": {
+        "invoice_curr":    "category",
+        "invoice_amount":  None,
+        "discount_amount": None,
+        "add_comments":    None,
+        "invoice_id":      "Int64",
+    },
+}
 
 ALIAS_ENV = {
     "payload_id":      ["payloadid"],
@@ -158,7 +215,7 @@ def _to_float(x, default=0.0):
         return default
 
 def _blank_if_none(v):
-    if v is None:
+    if v is None or v is pd.NA or v is pd.NaT:
         return ""
     if isinstance(v, float) and pd.isna(v):
         return ""
@@ -174,11 +231,16 @@ def _add_el(parent, tag, **attrib):
 
 
 
+@lru_cache(maxsize=1024)
+def _lower_colmap(columns: tuple) -> Dict[str, str]:
+    """Mapa lower->nombre_real de un esquema de columnas (se calcula una vez por esquema)."""
+    return {str(c).strip().lower(): c for c in columns}
+
 def _find_col(df: pd.DataFrame, candidates):
     """Devuelve el nombre REAL de la primera columna que exista (case-insensitive)."""
     if df is None or df.empty:
         return None
-    cmap = {c.lower(): c for c in df.columns}
+    cmap = _lower_colmap(tuple(df.columns))
     for cand in candidates:
         c = str(cand).strip().lower()
         if c in cmap:
@@ -202,7 +264,7 @@ def _first_value(df, cols, default=None):
     # Caso DataFrame
     if isinstance(df, pd.DataFrame) and not df.empty:
         # Mapa lower->nombre_real para tolerar mayúsculas/espacios
-        colmap = {str(c).strip().lower(): c for c in df.columns}
+        colmap = _lower_colmap(tuple(df.columns))
         for name in candidates:
             key = str(name).strip().lower()
             if key in colmap:
@@ -229,7 +291,145 @@ def _first_value(df, cols, default=None):
     return default
 
 
-    return doctype + doc
+# Tablas de aliases que se pueden compilar a un plan de columnas
+_ALIAS_TABLES = {
+    "env":  ALIAS_ENV,
+    "hdr":  ALIAS_HDR,
+    "part": ALIAS_PART,
+    "idr":  ALIAS_IDR,
+    "oi":   ALIAS_OI,
+    "it":   ALIAS_IT,
+    "tax":  ALIAS_TAX,
+    "sum":  ALIAS_SUM,
+    "ext":  ALIAS_EXT,
+}
+
+@lru_cache(maxsize=1024)
+def _compile_alias_plan(columns: tuple, table: str) -> Dict[str, tuple]:
+    """
+    Plan de resolución de un esquema: campo lógico -> columnas reales que casan
+    con sus aliases, en orden de preferencia. Se compila una vez por
+    (tupla de columnas, tabla de aliases) y se reutiliza en todas las facturas.
+    """
+    colmap = _lower_colmap(columns)
+    plan = {}
+    for field, candidates in _ALIAS_TABLES[table].items():
+        real_cols = []
+        for cand in candidates:
+            real = colmap.get(str(cand).strip().lower())
+            if real is not None and real not in real_cols:
+                real_cols.append(real)
+        plan[field] = tuple(real_cols)
+    return plan
+
+def _column_plan(df, table: str) -> Dict[str, tuple]:
+    """Plan de columnas de `df` para la tabla de aliases `table` ({} si df está vacío)."""
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return {}
+    return _compile_alias_plan(tuple(df.columns), table)
+
+def _plan_col(plan: Dict[str, tuple], field: str):
+    """Equivalente a _find_col usando un plan ya compilado."""
+    cols = plan.get(field)
+    return cols[0] if cols else None
+
+def _plan_value(df, plan: Dict[str, tuple], field: str, default=None):
+    """Equivalente a _first_value(df, ALIAS[field]) usando un plan ya compilado."""
+    for col in plan.get(field, ()):
+        val = df[col].iloc[0]
+        if pd.isna(val) or val == "":
+            continue
+        return val
+    return default
+
+STATUS_OK_CODES = (200, 201)
+STATUS_BULK_CHUNK = 1000   # filas por sentencia UPDATE ... FROM (VALUES ...)
+
+_INSERT_EXCEPTION_SQL = text("""
+    INSERT INTO public.examin_exception
+        (exception_id,exception_type, trans_id, trans_version, business_date, status, trade_date)
+    VALUES (nextval('transaction_seq'),:exception_type, :trans_id, :trans_version, :business_date, :status, :trade_date)
+""")
+
+
+def _status_row(invoice_id, http_code, description, invoice_date) -> dict:
+    try:
+        inv_id = int(float(invoice_id))
+    except Exception:
+        inv_id = str(invoice_id)
+    try:
+        sc = int(http_code)
+    except Exception:
+        sc = None
+    inv_date_iso = None
+    if invoice_date is not None and pd.notna(invoice_date):
+        d = pd.to_datetime(invoice_date, errors="coerce")
+        if pd.notna(d):
+            inv_date_iso = d.date().isoformat()
+    ok = sc in STATUS_OK_CODES
+    return {"invoice_id": inv_id, "http_code": sc, "description": description,
+            "invoice_date": inv_date_iso, "status": "SENT" if ok else "ERROR", "ok": ok}
+
+
+def _collapse_status_rows(rows: list) -> list:
+    """
+    Una fila por invoice_id (una factura con varias hojas da un resultado por archivo):
+    ERROR gana sobre SENT; entre varios ERROR se queda el primero. Mantiene el orden.
+    """
+    by_invoice: Dict = {}
+    for r in rows:
+        prev = by_invoice.get(r["invoice_id"])
+        if prev is None or (prev["ok"] and not r["ok"]):
+            by_invoice[r["invoice_id"]] = r
+    return list(by_invoice.values())
+
+
+def update_status_bulk(results) -> dict:
+    """
+    Aplica en una sola transacción el resultado de muchos envíos.
+    `results`: iterable de (invoice_id, http_code, description, invoice_date).
+      - no 200/201: INSERT en examin_exception (executemany) y good_to_pay -> ERROR + comments
+      - 200/201:    good_to_pay -> SENT
+    Las actualizaciones de good_to_pay van en bloques de STATUS_BULK_CHUNK filas
+    con UPDATE ... FROM (VALUES ...) en vez de una sentencia por factura.
+    Los resultados repetidos de una factura se reducen antes a uno (ERROR gana).
+    """
+    rows = _collapse_status_rows([_status_row(*r) for r in results])
+    if not rows:
+        return {"sent": 0, "errors": 0}
+    failures = [r for r in rows if not r["ok"]]
+
+    engine = get_connection('')
+    with engine.begin() as con:
+        if failures:
+            con.execute(_INSERT_EXCEPTION_SQL, [{
+                "exception_type": "goodToPay_Validation",
+                "trans_id":       r["invoice_id"],
+                "trans_version":  1,
+                "business_date":  r["invoice_date"],
+                "status":         "Pending",
+                "trade_date":     r["invoice_date"],
+            } for r in failures])
+
+        for start in range(0, len(rows), STATUS_BULK_CHUNK):
+            chunk = rows[start:start + STATUS_BULK_CHUNK]
+            values, params = [], {}
+            for i, r in enumerate(chunk):
+                values.append(f"(CAST(:id{i} AS bigint), CAST(:st{i} AS text), CAST(:ds{i} AS text))")
+                params.update({f"id{i}": r["invoice_id"], f"st{i}": r["status"],
+                               f"ds{i}": None if r["ok"] else r["description"]})
+            con.execute(text(f"""
+                UPDATE public.good_to_pay AS g
+                   SET record_status = v.status,
+                       update_datetime = NOW(),
+                       comments = CASE WHEN v.status = 'ERROR' THEN v.description ELSE g.comments END
+                  FROM (VALUES {", ".join(values)}) AS v(invoice_id, status, description)
+                 WHERE g.invoice_id = v.invoice_id
+            """), params)
+
+    print(f"[update_status_bulk] SENT={len(rows) - len(failures)} ERROR={len(failures)}")
+    return {"sent": len(rows) - len(failures), "errors": len(failures)}
+
 
 def update_status(status_code, description, df):
     """
@@ -238,6 +438,7 @@ def update_status(status_code, description, df):
       - invoiceDate -> business_date / trade_date
     On non-200/201, inserts into examin_exception.
     On 200/201, updates good_to_pay to SENT (or whatever 'description' says if you prefer).
+    Para muchas facturas usar update_status_bulk (una transacción por lote).
     """
     if df is None or not hasattr(df, "empty") or df.empty:
         raise ValueError("update_status: df is empty or invalid")
@@ -249,65 +450,13 @@ def update_status(status_code, description, df):
 
     # first non-null row
     row = df[df["InvoiceID"].notna()].iloc[0]
+    status = _status_row(row["InvoiceID"], status_code, description,
+                         row[col_invoice_date] if col_invoice_date else None)
+    update_status_bulk([(status["invoice_id"], status["http_code"], description, status["invoice_date"])])
 
-    inv_id_raw = row["InvoiceID"]
-    try:
-        inv_id = int(float(inv_id_raw))
-    except Exception:
-        inv_id = str(inv_id_raw)  # still from df
-
-    inv_date_iso = None
-    if col_invoice_date and pd.notna(row[col_invoice_date]):
-        d = pd.to_datetime(row[col_invoice_date], errors="coerce")
-        if pd.notna(d):
-            inv_date_iso = d.date().isoformat()
-
-    try:
-        sc = int(status_code)
-    except Exception:
-        sc = None
-
-    engine = get_connection('')
-
-    if sc not in (200, 201):
-        # --- failure path: insert exception, DO NOT mark as SENT ---
-        exception = {
-            "exception_type": "goodToPay_Validation",
-            # if your table has SERIAL/BIGSERIAL, don't pass exception_id at all
-            "exception_id": "115",
-            "trans_id":       inv_id,
-            "trans_version":  1,
-            "business_date":  inv_date_iso,
-            "status":         "Pending",
-            "trade_date":     inv_date_iso,
-            "description":    description,
-            "http_code":      sc,
-        }
-        print(exception)
-        with engine.begin() as con:
-            con.execute(text("""
-                INSERT INTO public.examin_exception
-                    (exception_id,exception_type, trans_id, trans_version, business_date, status, trade_date)
-                VALUES (nextval('transaction_seq'),:exception_type, :trans_id, :trans_version, :business_date, :status, :trade_date)
-            """), exception)
-            # Optional: reflect error status in good_to_pay
-            con.execute(text("""
-                UPDATE public.good_to_pay
-                   SET record_status = :status, update_datetime = NOW(),comments= :description
-                 WHERE invoice_id = :invoice_id
-            """), {"status": "ERROR", "invoice_id": inv_id,"description":description})
-
-        return {"recorded": "exception", "invoice_id_from_df": inv_id, "http_code": sc}
-    else:
-        # --- success path: mark SENT (or use `description` value if you want) ---
-        with engine.begin() as con:
-            con.execute(text("""
-                UPDATE public.good_to_pay
-                SET record_status = :status, update_datetime = NOW()
-                WHERE invoice_id = :invoice_id
-            """), {"status": "SENT", "invoice_id": inv_id})
-
-    return {"result": "ok", "invoice_id_from_df": inv_id, "http_code": sc}
+    if not status["ok"]:
+        return {"recorded": "exception", "invoice_id_from_df": status["invoice_id"], "http_code": status["http_code"]}
+    return {"result": "ok", "invoice_id_from_df": status["invoice_id"], "http_code": status["http_code"]}
 
 
 def _nonempty_df(df):
@@ -368,15 +517,48 @@ def load_data(
     table: str,
     schema: str = "public",
     where: str = None,          # e.g. "COALESCE(record_active_ind,'Y')='Y'"
-    columns: list = None        # e.g. ["gtp_id", "invoice_id", "invoice_curr"]
+    columns: list = None,       # e.g. ["gtp_id", "invoice_id", "invoice_curr"]; None => TABLE_SCHEMAS o *
+    params: dict = None         # e.g. {"ids": [1, 2, 3]} para "invoice_id = ANY(:ids)"
 ) -> pd.DataFrame:
     """
     Lee registros de la DB y devuelve un DataFrame.
     - `table`: nombre de tabla (con o sin schema)
     - `schema`: por defecto 'public'; si pasas None y table ya viene con schema, lo respetamos
-    - `columns`: lista de columnas (si None => *)
+    - `columns`: lista de columnas (si None => las de TABLE_SCHEMAS[table], o * si no está declarada)
+    - los tipos declarados en TABLE_SCHEMAS se aplican a las columnas leídas
     - `where`: condición SIN la palabra WHERE (se agrega automáticamente si viene)
+    - `params`: parámetros enlazados (:nombre) usados en `where`
     """
+    dtypes = _table_schema(table)
+    query = _select_query(table, schema, where, columns or list(dtypes))
+    print(f"[load_data] Ejecutando query: {query}")
+
+    # Engine compartido del proceso: no se cierra aquí para reutilizar el pool
+    con = get_connection('')
+    df = pd.read_sql(text(query) if params else query, con=con, params=params)
+    return _apply_dtypes(_normalize_loaded(df), dtypes)
+
+
+def _table_schema(table: str) -> dict:
+    """Entrada de TABLE_SCHEMAS para `table` (con o sin schema); {} si no está declarada."""
+    return TABLE_SCHEMAS.get(table.strip().split(".")[-1].lower(), {})
+
+
+def _apply_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    for col, dtype in dtypes.items():
+        if dtype is None or col not in df.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif dtype in ("Int64", "float64"):
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(dtype)
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _select_query(table: str, schema: str = "public", where: str = None,
+                  columns: list = None, order_by: str = None) -> str:
     table = table.strip()
 
     # Si el usuario pasó table con schema (p.ej. "otro.good_to_pay"), lo respetamos.
@@ -394,25 +576,90 @@ def load_data(
     query = f"SELECT {cols} FROM {full_name}"
     if where:
         query += f" WHERE {where}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    return query
+
+
+def _normalize_loaded(df: pd.DataFrame) -> pd.DataFrame:
+    # Normaliza fechas útiles
+    for col in ("invoice_date","receipt_date","business_date","add_datetime","update_datetime","verify_datetime"):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    # Normaliza nombres
+    df.columns = [c.strip().lower() for c in df.columns]
+    return df
 
-    print(f"[load_data] Ejecutando query: {query}")
 
-    con = get_connection('')
-    try:
-        df = pd.read_sql(query, con=con)
-        # Normaliza fechas útiles
-        for col in ("invoice_date","receipt_date","business_date","add_datetime","update_datetime","verify_datetime"):
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors="coerce")
-        # Normaliza nombres
-        df.columns = [c.strip().lower() for c in df.columns]
-        return df
-    finally:
+def iter_load_data(
+    table: str,
+    schema: str = "public",
+    where: str = None,
+    columns: list = None,
+    params: dict = None,
+    key: str = "invoice_id",
+    chunksize: int = 50000,
+):
+    """
+    Variante en streaming de load_data: cursor del lado del servidor (stream_results)
+    leído en bloques de ~`chunksize` filas, ordenados por `key`.
+    Cada DataFrame que se entrega contiene facturas completas: las filas de la última
+    `key` de un bloque se retienen y se anteponen al siguiente.
+    """
+    dtypes = _table_schema(table)
+    # Filas sin clave no pertenecen a ninguna factura: fuera, para no romper la agrupación
+    key_where = f"{key} IS NOT NULL" if not where else f"({where}) AND {key} IS NOT NULL"
+    query = _select_query(table, schema, key_where, columns or list(dtypes), order_by=key)
+    print(f"[iter_load_data] Ejecutando query: {query} (chunksize={chunksize})")
+
+    engine = get_connection('')
+    pending = None
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as con:
+        for chunk in pd.read_sql(text(query), con=con, params=params, chunksize=chunksize):
+            chunk = _apply_dtypes(_normalize_loaded(chunk), dtypes)
+            if pending is not None and not pending.empty:
+                chunk = _concat_typed([pending, chunk], dtypes)
+            if chunk.empty:
+                continue
+            last = chunk[key].iloc[-1]
+            tail = (chunk[key] == last).fillna(False).to_numpy(dtype=bool)
+            pending = chunk[tail]
+            ready = chunk[~tail]
+            if not ready.empty:
+                yield ready.reset_index(drop=True)
+    if pending is not None and not pending.empty:
+        yield pending.reset_index(drop=True)
+
+
+def _concat_typed(frames: list, dtypes: dict) -> pd.DataFrame:
+    # concat de "category" con categorías distintas degrada a object: se re-tipa
+    return _apply_dtypes(pd.concat(frames, ignore_index=True), {c: t for c, t in dtypes.items() if t == "category"})
+
+
+def prefetch(iterable, depth: int = 1):
+    """
+    Consume `iterable` en un hilo aparte con hasta `depth` elementos adelantados,
+    para que la lectura del siguiente bloque se solape con el proceso del actual.
+    """
+    q = queue.Queue(maxsize=max(1, depth))
+    done = object()
+
+    def _producer():
         try:
-            if con is not None and hasattr(con, "close"):
-                con.close()
-        except Exception:
-            pass
+            for item in iterable:
+                q.put(item)
+            q.put(done)
+        except BaseException as e:   # se re-lanza en el hilo consumidor
+            q.put(e)
+
+    threading.Thread(target=_producer, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
 
 def _build_sheet_envelope():
     now = pd.Timestamp.now()
@@ -459,29 +706,51 @@ def _build_sheet_header(head ) -> pd.DataFrame:
 
     return hdr
 
-def _build_sheet_items(invoice_id) -> pd.DataFrame:
+def load_invoice_details(invoice_ids, chunk_size: int = 5000) -> Dict[int, pd.DataFrame]:
+    """
+    Carga invoice_detail de muchas facturas con un SELECT por bloque
+    (`invoice_id = ANY(:ids)`) y lo agrupa una sola vez en memoria.
+    Devuelve {invoice_id: DataFrame con las líneas de esa factura}.
+    """
+    ids = sorted({int(float(i)) for i in invoice_ids if pd.notna(i)})
+    frames = []
+    for start in range(0, len(ids), chunk_size):
+        frames.append(load_data(
+            table='invoice_detail',
+            where="invoice_id = ANY(:ids) and COALESCE(record_active_ind,'Y')='Y'",
+            columns=DETAIL_COLUMNS,
+            params={"ids": ids[start:start + chunk_size]},
+        ))
+    if not frames:
+        return {}
+    details = _concat_typed(frames, _table_schema("invoice_detail"))
+    return {int(k): g.reset_index(drop=True) for k, g in details.groupby("invoice_id", sort=False)}
+
+def _build_sheet_items(invoice_id, items_df: pd.DataFrame = None) -> pd.DataFrame:
     invoice_id = int(float(invoice_id))
-    items_df = load_data(table='invoice_detail',where=f"invoice_id = {invoice_id} and COALESCE(record_active_ind,'Y')='Y'",columns=['invoice_curr', 'invoice_amount','discount_amount','add_comments','invoice_id'])
+    if items_df is None:
+        items_df = load_data(table='invoice_detail',where=f"invoice_id = {invoice_id} and COALESCE(record_active_ind,'Y')='Y'",columns=DETAIL_COLUMNS)
     print(items_df)
 
     g = items_df
     # Intentamos detectar columnas de detalle (por alias)
-    c_line = _find_col(g, ALIAS_IT["line_no"])
-    c_qty  = _find_col(g, ALIAS_IT["quantity"])
+    it_plan = _column_plan(g, "it")
+    c_line = _plan_col(it_plan, "line_no")
+    c_qty  = _plan_col(it_plan, "quantity")
 
-    c_unitmeasure  = _find_col(g, ALIAS_IT["uom"])
-    c_price= _find_col(g, ALIAS_IT["unit_price"])
-    c_pcur = _find_col(g, ALIAS_IT["price_curr"])
-    c_desc = _find_col(g, ALIAS_IT["description"])
-    c_sub  = _find_col(g, ALIAS_IT["subtotal"])
-    c_scur = _find_col(g, ALIAS_IT["subtotal_curr"])
+    c_unitmeasure  = _plan_col(it_plan, "uom")
+    c_price= _plan_col(it_plan, "unit_price")
+    c_pcur = _plan_col(it_plan, "price_curr")
+    c_desc = _plan_col(it_plan, "description")
+    c_sub  = _plan_col(it_plan, "subtotal")
+    c_scur = _plan_col(it_plan, "subtotal_curr")
 
 
-    money = _find_col(g, ALIAS_IT["money"])
-    taxableAmount = _find_col(g, ALIAS_IT["taxableAmount"])
-    NetAmount = _find_col(g, ALIAS_IT["NetAmount"])
-    taxDescription = _find_col(g, ALIAS_IT["taxDescription"])
-    currency = _find_col(g, ALIAS_IT["currency"])
+    money = _plan_col(it_plan, "money")
+    taxableAmount = _plan_col(it_plan, "taxableAmount")
+    NetAmount = _plan_col(it_plan, "NetAmount")
+    taxDescription = _plan_col(it_plan, "taxDescription")
+    currency = _plan_col(it_plan, "currency")
 
     has_detail =  len(items_df) >= 1
     print(f'items is {has_detail}')
@@ -549,12 +818,14 @@ def  _build_sheet_summary_from_items(it: pd.DataFrame, fallback_curr: Optional[s
         cur = fallback_curr or ""
         return dict(subtotal=0.0, taxable=0.0, tax=0.0, net=0.0, gross=0.0, currency=cur)
 
-    c_sub  = _find_col(it, ALIAS_IT["subtotal"])
-    c_scur = _find_col(it, ALIAS_IT["subtotal_curr"])
-    c_tax  = _find_col(it, ALIAS_IT["money"])             # impuesto de la línea
-    c_net  = _find_col(it, ALIAS_IT["NetAmount"])         # neto de la línea (opcional)
-    c_taxable = _find_col(it, ALIAS_IT["taxableAmount"])  # base imponible por línea (si la traes)
-    c_lcur = _find_col(it, ALIAS_IT["currency"]) or _find_col(it, ALIAS_IT["price_curr"])
+    it_plan = _column_plan(it, "it")
+
+    c_sub  = _plan_col(it_plan, "subtotal")
+    c_scur = _plan_col(it_plan, "subtotal_curr")
+    c_tax  = _plan_col(it_plan, "money")             # impuesto de la línea
+    c_net  = _plan_col(it_plan, "NetAmount")         # neto de la línea (opcional)
+    c_taxable = _plan_col(it_plan, "taxableAmount")  # base imponible por línea (si la traes)
+    c_lcur = _plan_col(it_plan, "currency") or _plan_col(it_plan, "price_curr")
 
     subtotal = it[c_sub].map(_to_float).sum() if c_sub else 0.0
     tax      = it[c_tax].map(_to_float).sum() if c_tax else 0.0
@@ -654,7 +925,67 @@ def _build_sheet_extrinsics(inv_id,head):
 def _build_sheet_tax():
     return True
 
-def build_sheets_from_snapshot(snapshot: pd.DataFrame, invoice_id) -> dict:
+class SnapshotIndex:
+    """
+    Índice de un DataFrame por factura: se ordena una sola vez por `invoice_id` y cada
+    consulta resuelve su rango con searchsorted (O(log N)) y devuelve un slice, sin
+    recorrer ni copiar el DataFrame completo como hace `df[df["invoice_id"] == id]`.
+    Sirve para el snapshot de good_to_pay y para las hojas multi-factura (_filter_by_invoice).
+    """
+
+    def __init__(self, df: pd.DataFrame, key: str = None):
+        col = key if key in df.columns else _find_col(df, ["invoice_id", "invoiceid", "InvoiceID"])
+        if not col:
+            raise ValueError("SnapshotIndex: el DataFrame no tiene columna invoice_id")
+        keys = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        if pd.Index(keys).is_monotonic_increasing:
+            self.frame = df
+            self._keys = keys
+        else:
+            order = np.argsort(keys, kind="stable")
+            self.frame = df.iloc[order]
+            self._keys = keys[order]
+        self.key = col
+
+    def _bounds(self, invoice_id):
+        k = float(invoice_id)
+        return (int(np.searchsorted(self._keys, k, side="left")),
+                int(np.searchsorted(self._keys, k, side="right")))
+
+    def rows(self, invoice_id) -> pd.DataFrame:
+        """Filas de `invoice_id` (vacío si no existe), en el orden original."""
+        lo, hi = self._bounds(invoice_id)
+        return self.frame.iloc[lo:hi]
+
+    def first(self, invoice_id) -> Optional[pd.Series]:
+        lo, hi = self._bounds(invoice_id)
+        return self.frame.iloc[lo] if hi > lo else None
+
+    def __contains__(self, invoice_id) -> bool:
+        lo, hi = self._bounds(invoice_id)
+        return hi > lo
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+
+def index_sheets(sheets: Dict[str, pd.DataFrame]) -> Dict[str, SnapshotIndex]:
+    """SnapshotIndex de cada hoja que tenga columna de factura (para _filter_by_invoice)."""
+    indexes = {}
+    for name, df in sheets.items():
+        if isinstance(df, pd.DataFrame) and not df.empty and _find_col(df, ["invoice_id", "invoiceid", "InvoiceID"]):
+            indexes[name] = SnapshotIndex(df)
+    return indexes
+
+
+def build_sheets_from_snapshot(snapshot, invoice_id, details: Dict[int, pd.DataFrame] = None) -> dict:
+    """
+    Construye las hojas (Envelope/Header/Partners/Items/Summary/Extrinsics) de una factura.
+    `snapshot` puede ser el DataFrame de good_to_pay o un SnapshotIndex (recomendado en
+    lotes: evita recorrer el snapshot completo por cada factura).
+    `details` es el índice devuelto por load_invoice_details; si no viene, las líneas
+    se consultan a la BD solo para esta factura.
+    """
     def _num_or_0(v):
         v = _blank_if_none(v)
         try:
@@ -662,7 +993,10 @@ def build_sheets_from_snapshot(snapshot: pd.DataFrame, invoice_id) -> dict:
         except Exception:
             return 0.0
 
-    g = snapshot[snapshot["invoice_id"] == invoice_id].copy()
+    if isinstance(snapshot, SnapshotIndex):
+        g = snapshot.rows(invoice_id)
+    else:
+        g = snapshot[snapshot["invoice_id"] == invoice_id].copy()
     if g.empty:
         raise ValueError(f"No hay registros en good_to_pay para invoice_id={invoice_id}")
 
@@ -685,14 +1019,15 @@ def build_sheets_from_snapshot(snapshot: pd.DataFrame, invoice_id) -> dict:
 
     # =========================
     # Items (multi-línea si hay detalle)
-
-    items_df = load_data(table='invoice_detail',where=f"invoice_id = {invoice_id} and COALESCE(record_active_ind,'Y')='Y'",columns=['invoice_curr', 'invoice_amount','discount_amount','add_comments','invoice_id'])
+    items_df = None
+    if details is not None:
+        items_df = details.get(int(float(invoice_id)), pd.DataFrame(columns=DETAIL_COLUMNS))
     # =========================
     net   = _blank_if_none(head.get("net_invoice_amount"))
     gross = _blank_if_none(head.get("gross_invoice_amount"))
     curr  = _blank_if_none(head.get("invoice_curr"))
 
-    items = _build_sheet_items(invoice_id=invoice_id)
+    items = _build_sheet_items(invoice_id=invoice_id, items_df=items_df)
 
 
     # =========================
@@ -748,32 +1083,35 @@ def _add_money(parent, tag, amount, currency: Optional[str]):
     return el
 
 
-def dump_xml(elem, include_doctype=True):
-    # serializa
-    raw = ET.tostring(elem, encoding="utf-8", xml_declaration=True)
-    # pretty print (si falla, seguimos con raw)
-    try:
-        pretty = minidom.parseString(raw).toprettyxml(indent="  ", encoding="UTF-8")
-    except Exception:
-        pretty = raw
+def dump_xml(elem, include_doctype=True, echo=False):
+    """
+    Serializa `elem` indentado (2 espacios) con la declaración XML y el DOCTYPE
+    en una sola pasada (ET.indent + write), sin reparsear con minidom.
+    - Se indenta una copia: el árbol del llamador (que luego puede firmarse o
+      reutilizarse) no cambia, igual que con minidom.
+    - `echo=True` además lo imprime por consola.
+    """
+    root = elem.getroot() if hasattr(elem, "getroot") else elem
+    root = copy.deepcopy(root)
+    ET.indent(root, space="  ")
 
+    buf = io.BytesIO()
+    buf.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
     if include_doctype:
-        # evita duplicar la declaración XML, ya viene en `pretty`
-        # insertamos el DOCTYPE justo después de la 1ª línea
-        lines = pretty.splitlines()
-        if lines and lines[0].startswith(b'<?xml'):
-            output = b'\n'.join([lines[0], CXML_DTD.encode('utf-8')] + lines[1:])
-        else:
-            output = CXML_DTD.encode('utf-8') + b'\n' + pretty
-    else:
-        output = pretty
+        buf.write(CXML_DTD.encode('utf-8') + b'\n')
+    ET.ElementTree(root).write(buf, encoding="utf-8", xml_declaration=False)
+    buf.write(b'\n')
+    output = buf.getvalue()
 
-    print(output.decode('utf-8'))         # ▶ lo ves en consola
-    return output   
+    if echo:
+        print(output.decode('utf-8'))         # ▶ lo ves en consola
+    return output
 
 
-def _filter_by_invoice(df: pd.DataFrame, invoice_id) -> pd.DataFrame:
+def _filter_by_invoice(df: pd.DataFrame, invoice_id, index: Optional["SnapshotIndex"] = None) -> pd.DataFrame:
     import pandas as pd
+    if index is not None:
+        return index.rows(invoice_id).reset_index(drop=True)
     if df is None or (isinstance(df, pd.DataFrame) and df.empty):
         return df
     if not isinstance(df, pd.DataFrame):
@@ -793,21 +1131,23 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
         Tuple[Element, Element]: (hdr_el, inv_req)
     """
     header = ET.SubElement(cxml, "Header")
+    env_plan = _column_plan(env, "env")
+    hdr_plan = _column_plan(hdr, "hdr")
 
     # ----- From
-    f_dom  = _text_or_none(_first_value(env, ALIAS_ENV["from_domain"]))
-    f_id   = _text_or_none(_first_value(env, ALIAS_ENV["from_identity"]))
-    f_dom2 = _text_or_none(_first_value(env, ALIAS_ENV["from_domain2"]))
-    f_id2  = _text_or_none(_first_value(env, ALIAS_ENV["from_identity2"]))
-    f_dom3 = _text_or_none(_first_value(env, ALIAS_ENV["from_domain3"]))
-    f_id3  = _text_or_none(_first_value(env, ALIAS_ENV["from_identity3"]))
-    f_name = _text_or_none(_first_value(env, ALIAS_ENV["from_corr_name"]))
-    f_street = _text_or_none(_first_value(env, ALIAS_ENV["street"]))
-    f_city = _text_or_none(_first_value(env, ALIAS_ENV["city"]))
-    f_postalcode = _text_or_none(_first_value(env, ALIAS_ENV["postalcode"]))
-    f_country    = _text_or_none(_first_value(env, ALIAS_ENV["country"]))
-    f_isocountry = _text_or_none(_first_value(env, ALIAS_ENV["isocountry"]))
-    f_language   = _text_or_none(_first_value(env, ALIAS_ENV["preferred_language"]))
+    f_dom  = _text_or_none(_plan_value(env, env_plan, "from_domain"))
+    f_id   = _text_or_none(_plan_value(env, env_plan, "from_identity"))
+    f_dom2 = _text_or_none(_plan_value(env, env_plan, "from_domain2"))
+    f_id2  = _text_or_none(_plan_value(env, env_plan, "from_identity2"))
+    f_dom3 = _text_or_none(_plan_value(env, env_plan, "from_domain3"))
+    f_id3  = _text_or_none(_plan_value(env, env_plan, "from_identity3"))
+    f_name = _text_or_none(_plan_value(env, env_plan, "from_corr_name"))
+    f_street = _text_or_none(_plan_value(env, env_plan, "street"))
+    f_city = _text_or_none(_plan_value(env, env_plan, "city"))
+    f_postalcode = _text_or_none(_plan_value(env, env_plan, "postalcode"))
+    f_country    = _text_or_none(_plan_value(env, env_plan, "country"))
+    f_isocountry = _text_or_none(_plan_value(env, env_plan, "isocountry"))
+    f_language   = _text_or_none(_plan_value(env, env_plan, "preferred_language"))
     default_lang = f_language or "en-US"
 
     From = ET.SubElement(header, "From")
@@ -835,10 +1175,10 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
                 _add_text(pa, "Country", f_country, country_attrib)
 
     # ----- To (Credential+ requerido por el DTD)
-    to_dom1 = _text_or_none(_first_value(env, ALIAS_ENV["to_cred1_domain"]))
-    to_id1  = _text_or_none(_first_value(env, ALIAS_ENV["to_cred1_identity"]))
-    to_dom2 = _text_or_none(_first_value(env, ALIAS_ENV["to_cred2_domain"]))
-    to_id2  = _text_or_none(_first_value(env, ALIAS_ENV["to_cred2_identity"]))
+    to_dom1 = _text_or_none(_plan_value(env, env_plan, "to_cred1_domain"))
+    to_id1  = _text_or_none(_plan_value(env, env_plan, "to_cred1_identity"))
+    to_dom2 = _text_or_none(_plan_value(env, env_plan, "to_cred2_domain"))
+    to_id2  = _text_or_none(_plan_value(env, env_plan, "to_cred2_identity"))
 
     To = ET.SubElement(header, "To")
 
@@ -868,10 +1208,10 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
         _add_text(cred, "Identity", ident)
 
     # ----- Sender (después de To)
-    s_dom = _text_or_none(_first_value(env, ALIAS_ENV["sender_domain"]))
-    s_id  = _text_or_none(_first_value(env, ALIAS_ENV["sender_identity"]))
-    s_sec = _text_or_none(_first_value(env, ALIAS_ENV["sender_secret"]))
-    ua    = _text_or_none(_first_value(env, ALIAS_ENV["user_agent"], "Notebook cXML Builder"))
+    s_dom = _text_or_none(_plan_value(env, env_plan, "sender_domain"))
+    s_id  = _text_or_none(_plan_value(env, env_plan, "sender_identity"))
+    s_sec = _text_or_none(_plan_value(env, env_plan, "sender_secret"))
+    ua    = _text_or_none(_plan_value(env, env_plan, "user_agent", "Notebook cXML Builder"))
 
     Sender = ET.SubElement(header, "Sender")
     if s_dom or s_id or s_sec:
@@ -882,18 +1222,18 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
     _add_text(Sender, "UserAgent", ua)
 
     # ---------- Request
-    request_id = _text_or_none(_first_value(env, ALIAS_ENV["request_id"], "cXMLData"))
-    dep_mode   = _text_or_none(_first_value(env, ALIAS_ENV["deployment_mode"], "test"))
-    Request = ET.SubElement(cxml, "Request", attrib={"Id": request_id, "deploymentMode": dep_mode})
+    # Id fijo: es el destino de <ds:Reference URI="#cXMLData"> de la firma (ver _signature_template)
+    dep_mode   = _text_or_none(_plan_value(env, env_plan, "deployment_mode", "test"))
+    Request = ET.SubElement(cxml, "Request", attrib={"Id": SIGNED_DATA_ID, "deploymentMode": dep_mode})
     inv_req = ET.SubElement(Request, "InvoiceDetailRequest")
 
     # ---- Header de la factura
-    inv_date_raw = _first_value(hdr, ALIAS_HDR["invoice_date"], pd.Timestamp.today())
+    inv_date_raw = _plan_value(hdr, hdr_plan, "invoice_date", pd.Timestamp.today())
     inv_date     = _iso_dt(inv_date_raw, pd.Timestamp.today().isoformat())
-    inv_id_text  = _text_or_none(_first_value(hdr, ALIAS_HDR["invoice_id"], inv_id))
-    inv_origin   = _text_or_none(_first_value(hdr, ALIAS_HDR["invoice_origin"], "supplier"))
-    operation    = _text_or_none(_first_value(hdr, ALIAS_HDR["operation"], "new"))
-    purpose      = _text_or_none(_first_value(hdr, ALIAS_HDR["purpose"], "standard"))
+    inv_id_text  = _text_or_none(_plan_value(hdr, hdr_plan, "invoice_id", inv_id))
+    inv_origin   = _text_or_none(_plan_value(hdr, hdr_plan, "invoice_origin", "supplier"))
+    operation    = _text_or_none(_plan_value(hdr, hdr_plan, "operation", "new"))
+    purpose      = _text_or_none(_plan_value(hdr, hdr_plan, "purpose", "standard"))
 
     hdr_el = ET.SubElement(inv_req, "InvoiceDetailRequestHeader", attrib={
         "invoiceDate":   inv_date,
@@ -906,22 +1246,23 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
     ET.SubElement(hdr_el, "InvoiceDetailHeaderIndicator")
 
     # isTaxInLine: solo "yes"; si no, omite el atributo
-    raw_is_tax = _first_value(hdr, ALIAS_HDR['isTaxInLine'])
+    raw_is_tax = _plan_value(hdr, hdr_plan, "isTaxInLine")
     ind = ET.SubElement(hdr_el, "InvoiceDetailLineIndicator")
     if isinstance(raw_is_tax, str) and raw_is_tax.strip().lower() == "yes":
         ind.set("isTaxInLine", "yes")
 
-    comm = _text_or_none(_first_value(hdr, ALIAS_HDR["comments"]))
+    comm = _text_or_none(_plan_value(hdr, hdr_plan, "comments"))
 
     # Partners
     if _nonempty_df(prt):
-        role_col   = _find_col(prt, ALIAS_PART["role"])
-        addr_col   = _find_col(prt, ALIAS_PART["address_id"])
-        name_col   = _find_col(prt, ALIAS_PART["name"])
-        email_col  = _find_col(prt, ALIAS_PART["email"])
-        lang_col   = _find_col(prt, ALIAS_PART["lang"])
-        domain_col = _find_col(prt, ALIAS_PART['domain'])
-        ident_col  = _find_col(prt, ALIAS_PART['identifier'])
+        prt_plan   = _column_plan(prt, "part")
+        role_col   = _plan_col(prt_plan, "role")
+        addr_col   = _plan_col(prt_plan, "address_id")
+        name_col   = _plan_col(prt_plan, "name")
+        email_col  = _plan_col(prt_plan, "email")
+        lang_col   = _plan_col(prt_plan, "lang")
+        domain_col = _plan_col(prt_plan, "domain")
+        ident_col  = _plan_col(prt_plan, "identifier")
 
         def _safe_str(x): return "" if pd.isna(x) else str(x)
 
@@ -953,8 +1294,9 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
 
     # Extrinsics
     if _nonempty_df(ext):
-        ncol = _find_col(ext, ALIAS_EXT["name"])
-        vcol = _find_col(ext, ALIAS_EXT["value"])
+        ext_plan = _column_plan(ext, "ext")
+        ncol = _plan_col(ext_plan, "name")
+        vcol = _plan_col(ext_plan, "value")
         has_url_col = "attachment_url" in ext.columns
 
         for _, ex in ext.iterrows():
@@ -977,119 +1319,173 @@ def _section_header_and_request(cxml, env, hdr, prt, ext, inv_id):
 
 
 
-def _section_items(it: pd.DataFrame, parent: ET.Element, inv_date: str):
-    item_last = None
-    if it is None or it.empty:
-        return item_last
-
-    # columnas estándar
-    c_line = _find_col(it, ALIAS_IT["line_no"])
-    c_qty  = _find_col(it, ALIAS_IT["quantity"])
-    c_uom  = _find_col(it, ALIAS_IT["uom"])
-    c_price= _find_col(it, ALIAS_IT["unit_price"])
-    c_pcur = _find_col(it, ALIAS_IT["price_curr"])
-    c_ref  = _find_col(it, ALIAS_IT["ref_line"])
-    c_desc = _find_col(it, ALIAS_IT["description"])
-    c_sub  = _find_col(it, ALIAS_IT["subtotal"])
-    c_scur = _find_col(it, ALIAS_IT["subtotal_curr"])
+def _missing_mask(s: pd.Series) -> np.ndarray:
+    """True donde el valor es None/NaN/"" (vectorizado)."""
+    return (s.isna() | s.astype(object).eq("")).to_numpy()
+
+def _text_list(s: pd.Series) -> list:
+    """_text_or_none aplicado a toda una columna: str sin espacios o None."""
+    return [_text_or_none(v) for v in s.tolist()]
+
+def _str_list(s: pd.Series) -> list:
+    return [str(v) for v in s.tolist()]
+
+def _prepare_item_columns(it: pd.DataFrame) -> Dict[str, list]:
+    """
+    Pre-cálculo vectorizado de todas las líneas: devuelve columnas de strings
+    listas para adjuntar al XML (número de línea, moneda, subtotal, impuesto,
+    tasa, base imponible y neto).
+    """
+    n = len(it)
+    it_plan = _column_plan(it, "it")
+    c_line = _plan_col(it_plan, "line_no")
+    c_qty  = _plan_col(it_plan, "quantity")
+    c_uom  = _plan_col(it_plan, "uom")
+    c_price= _plan_col(it_plan, "unit_price")
+    c_pcur = _plan_col(it_plan, "price_curr")
+    c_ref  = _plan_col(it_plan, "ref_line")
+    c_desc = _plan_col(it_plan, "description")
+    c_sub  = _plan_col(it_plan, "subtotal")
+    c_scur = _plan_col(it_plan, "subtotal_curr")
 
     # columnas de impuestos por ítem (las que añadiste a ALIAS_IT)
-    c_tax_money   = _find_col(it, ALIAS_IT["money"])              # monto de impuesto en la línea
-    c_taxable     = _find_col(it, ALIAS_IT["taxableAmount"])      # base imponible de la línea
-    c_net_amount  = _find_col(it, ALIAS_IT["NetAmount"])          # neto de la línea (opcional)
-    c_tax_desc    = _find_col(it, ALIAS_IT["taxDescription"])     # descripción del impuesto (p.ej. "vat")
-    c_curr_any    = _find_col(it, ALIAS_IT["currency"])           # moneda “de la línea” (si no, usamos pcur/scur)
-
-    seq = 1
-    for _, row in it.iterrows():
-        line_no = str(row.get(c_line)) if c_line and row.get(c_line) not in (None, "", np.nan) else str(seq)
-        qty     = row.get(c_qty, 1) if c_qty else 1
-        uom     = _text_or_none(row.get(c_uom)) if c_uom else "EA"
-        price   = row.get(c_price, 0) if c_price else 0
-        pcur    = _text_or_none(row.get(c_pcur)) if c_pcur else None
-        ref_ln  = str(row.get(c_ref)) if c_ref else None
-        desc    = _text_or_none(row.get(c_desc)) if c_desc else None
-        sub_val = row.get(c_sub, 0) if c_sub else (float(qty) or 0.0) * (float(price) or 0.0)
-        scur    = _text_or_none(row.get(c_scur)) if c_scur else pcur
-
-        # moneda preferida para la línea
-        line_currency = _text_or_none(row.get(c_curr_any)) or scur or pcur or ""
+    c_tax_money   = _plan_col(it_plan, "money")              # monto de impuesto en la línea
+    c_taxable     = _plan_col(it_plan, "taxableAmount")      # base imponible de la línea
+    c_net_amount  = _plan_col(it_plan, "NetAmount")          # neto de la línea (opcional)
+    c_tax_desc    = _plan_col(it_plan, "taxDescription")     # descripción del impuesto (p.ej. "vat")
+    c_curr_any    = _plan_col(it_plan, "currency")           # moneda “de la línea” (si no, usamos pcur/scur)
+
+    none_col = [None] * n
+    seq = [str(i) for i in range(1, n + 1)]
+
+    # Número de línea: el de la hoja o el secuencial si falta
+    if c_line:
+        line_no = np.where(_missing_mask(it[c_line]), seq, _str_list(it[c_line])).tolist()
+    else:
+        line_no = seq
+
+    qty   = it[c_qty] if c_qty else pd.Series([1] * n, index=it.index)
+    price = it[c_price] if c_price else pd.Series([0] * n, index=it.index)
+    uom   = [u if u else "EA" for u in _text_list(it[c_uom])] if c_uom else ["EA"] * n
+    pcur  = _text_list(it[c_pcur]) if c_pcur else none_col
+    scur  = _text_list(it[c_scur]) if c_scur else pcur
+    lcur  = _text_list(it[c_curr_any]) if c_curr_any else none_col
+
+    # Subtotal: el de la hoja o cantidad * precio
+    if c_sub:
+        sub_raw = it[c_sub]
+    else:
+        sub_raw = pd.to_numeric(qty, errors="coerce").fillna(0.0) * pd.to_numeric(price, errors="coerce").fillna(0.0)
+    sub_str = _str_list(sub_raw)
+    sub_num = pd.to_numeric(sub_raw, errors="coerce").to_numpy(dtype=float)
+
+    # Impuesto, base imponible y tasa
+    if c_tax_money:
+        tax_missing = _missing_mask(it[c_tax_money])
+        tax_num = pd.to_numeric(it[c_tax_money], errors="coerce").to_numpy(dtype=float)
+        tax_str = np.where(tax_missing, "0", _str_list(it[c_tax_money])).tolist()
+    else:
+        tax_missing = np.ones(n, dtype=bool)
+        tax_num = np.full(n, np.nan)
+        tax_str = ["0"] * n
+
+    if c_taxable:
+        base_missing = _missing_mask(it[c_taxable])
+        base_num = pd.to_numeric(it[c_taxable], errors="coerce").to_numpy(dtype=float)
+        taxable_str = np.where(base_missing, sub_str, _str_list(it[c_taxable])).tolist()
+    else:
+        base_missing = np.ones(n, dtype=bool)
+        base_num = np.full(n, np.nan)
+        taxable_str = sub_str
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(~tax_missing & ~base_missing & (base_num != 0.0), tax_num / base_num * 100.0, 0.0)
+    rate = np.nan_to_num(rate, nan=0.0, posinf=0.0, neginf=0.0)
+    rate_str = [f"{r:.2f}" for r in rate.tolist()]
+
+    tax_descr = _text_list(it[c_tax_desc]) if c_tax_desc else none_col
+
+    # Neto: el de la hoja o subtotal + impuesto (si el subtotal no es numérico, el subtotal tal cual)
+    calc_net = sub_num + np.where(np.isnan(tax_num), 0.0, tax_num)
+    calc_net_str = np.where(np.isnan(sub_num), sub_str, [str(v) for v in calc_net.tolist()]).tolist()
+    if c_net_amount:
+        net_str = np.where(_missing_mask(it[c_net_amount]), calc_net_str, _str_list(it[c_net_amount])).tolist()
+    else:
+        net_str = calc_net_str
+
+    return {
+        "line_no":   line_no,
+        "qty":       _str_list(qty),
+        "uom":       uom,
+        "price":     _str_list(price),
+        "currency":  [lc or sc or pc or "" for lc, sc, pc in zip(lcur, scur, pcur)],
+        "ref_line":  _str_list(it[c_ref]) if c_ref else none_col,
+        "desc":      _text_list(it[c_desc]) if c_desc else none_col,
+        "subtotal":  sub_str,
+        "tax":       tax_str,
+        "tax_descr": tax_descr,
+        "category":  [d or "vat" for d in tax_descr],
+        "rate":      rate_str,
+        "taxable":   taxable_str,
+        "net":       net_str,
+    }
+
+
+def _iter_item_elements(it: pd.DataFrame, inv_date: str):
+    """Genera los <InvoiceDetailItem> (sueltos, sin padre) a partir de las columnas pre-calculadas."""
+    if it is None or it.empty:
+        return
+    cols = _prepare_item_columns(it)
+    tax_point_date = str(_iso_dt(inv_date, inv_date))  # usa fecha de la factura
+
+    for (line_no, qty, uom, price, cur, ref_ln, desc, sub_val,
+         tax_amt, tax_descr, category, rate, taxable, net) in zip(
+            cols["line_no"], cols["qty"], cols["uom"], cols["price"], cols["currency"],
+            cols["ref_line"], cols["desc"], cols["subtotal"], cols["tax"], cols["tax_descr"],
+            cols["category"], cols["rate"], cols["taxable"], cols["net"]):
 
         # === Item ===
-        item_last = ET.SubElement(parent, "InvoiceDetailItem",
-                                  attrib={"invoiceLineNumber": line_no, "quantity": str(qty)})
-        _add_text(item_last, "UnitOfMeasure", uom if uom else "EA")
+        item = ET.Element("InvoiceDetailItem", attrib={"invoiceLineNumber": line_no, "quantity": qty})
+        _add_text(item, "UnitOfMeasure", uom)
 
-        up = ET.SubElement(item_last, "UnitPrice")
-        _add_text(up, "Money", str(price), {"currency": line_currency})
+        up = ET.SubElement(item, "UnitPrice")
+        _add_text(up, "Money", price, {"currency": cur})
 
         if ref_ln or desc:
-            ref = ET.SubElement(item_last, "InvoiceDetailItemReference",
-                                attrib={"lineNumber": ref_ln or line_no})
+            ref = ET.SubElement(item, "InvoiceDetailItemReference", attrib={"lineNumber": ref_ln or line_no})
             _add_text(ref, "Description", desc, {"xml:lang": "en"})
 
-        sub_el = ET.SubElement(item_last, "SubtotalAmount")
-        _add_text(sub_el, "Money", str(sub_val), {"currency": line_currency})
+        sub_el = ET.SubElement(item, "SubtotalAmount")
+        _add_text(sub_el, "Money", sub_val, {"currency": cur})
 
         # === Tax por ítem (desde ALIAS_IT) ===
-        tax_amount   = row.get(c_tax_money, None) if c_tax_money else None
-        taxable_base = row.get(c_taxable,   None) if c_taxable   else None
-        tax_descr    = _text_or_none(row.get(c_tax_desc)) if c_tax_desc else None
-
-        has_any_tax_data = any(v not in (None, "", np.nan) for v in [tax_amount, taxable_base, tax_descr])
-        # if has_any_tax_data:
-        print('this is the tax element b')
-        tax_el = ET.SubElement(item_last, "Tax")
-
-        # Nodo opcional "Money" en Tax (si quieres replicar tu ejemplo con alternateAmount=0.00)
-        _add_text(
-            tax_el, "Money",
-            str(tax_amount if tax_amount is not None else 0),
-            {"alternateAmount": "0.00", "alternateCurrency": line_currency, "currency": line_currency}
-        )
+        tax_el = ET.SubElement(item, "Tax")
+        _add_text(tax_el, "Money", tax_amt,
+                  {"alternateAmount": "0.00", "alternateCurrency": cur, "currency": cur})
         _add_text(tax_el, "Description", tax_descr, {"xml:lang": "en"})
 
-        # Calcula tasa si hay base > 0
-        try:
-            rate = (float(tax_amount) / float(taxable_base) * 100.0) if (tax_amount not in (None, "", np.nan) and taxable_base not in (None, "", np.nan) and float(taxable_base) != 0.0) else 0.0
-        except Exception:
-            rate = 0.0
-
         tdet = ET.SubElement(tax_el, "TaxDetail", attrib={
-            "category": (_text_or_none(tax_descr) or "vat"),
-            "percentageRate": f"{rate:.2f}",
-            "taxPointDate": str(_iso_dt(inv_date, inv_date)),  # usa fecha de la factura
+            "category": category,
+            "percentageRate": rate,
+            "taxPointDate": tax_point_date,
         })
-
-        # TaxableAmount
         ta = ET.SubElement(tdet, "TaxableAmount")
-        _add_text(ta, "Money",
-                    str(taxable_base if taxable_base not in (None, "", np.nan) else sub_val),
-                    {"currency": line_currency})
-
-        # TaxAmount
+        _add_text(ta, "Money", taxable, {"currency": cur})
         tamt = ET.SubElement(tdet, "TaxAmount")
-        _add_text(tamt, "Money",
-                    str(tax_amount if tax_amount not in (None, "", np.nan) else 0),
-                    {"currency": line_currency})
-
+        _add_text(tamt, "Money", tax_amt, {"currency": cur})
         _add_text(tdet, "Description", tax_descr, {"xml:lang": "en"})
 
-        # === NetAmount por ítem (si viene; si no, usa subtotal + impuesto) ===
-        net_val = None
-        if c_net_amount:
-            net_val = row.get(c_net_amount)
-        if net_val in (None, "", np.nan):
-            try:
-                net_val = float(sub_val) + (float(tax_amount) if tax_amount not in (None, "", np.nan) else 0.0)
-            except Exception:
-                net_val = sub_val
+        # === NetAmount por ítem (si viene; si no, subtotal + impuesto) ===
+        net_el = ET.SubElement(item, "NetAmount")
+        _add_text(net_el, "Money", net, {"currency": cur})
 
-        net_el = ET.SubElement(item_last, "NetAmount")
-        _add_text(net_el, "Money", str(net_val), {"currency": line_currency})
+        yield item
 
-        seq += 1
 
+def _section_items(it: pd.DataFrame, parent: ET.Element, inv_date: str):
+    item_last = None
+    for item_last in _iter_item_elements(it, inv_date):
+        parent.append(item_last)
     return item_last
 
 
@@ -1210,61 +1606,19 @@ def _section_tax(tax,summ,item,inv_date):
 
 
 
-def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame]) -> ET.ElementTree:
-    
-    inv_id = str(inv_id)
-    env = _filter_by_invoice(sheets["Envelope"], int(inv_id) if inv_id.isdigit() else inv_id)
-    hdr = _filter_by_invoice(sheets["Header"], int(inv_id) if inv_id.isdigit() else inv_id)
-    prt = _filter_by_invoice(sheets["Partners"], int(inv_id) if inv_id.isdigit() else inv_id)
-    # idr = _filter_by_invoice(sheets["IdRefs"], inv_id)
-    # oin = _filter_by_invoice(sheets["OrderInfo"], int(inv_id) if inv_id.isdigit() else inv_id)
-    oin = pd.DataFrame()
-    it  = _filter_by_invoice(sheets["Items"], int(inv_id) if inv_id.isdigit() else inv_id)
-    # tax = _filter_by_invoice(sheets["Taxes"], int(inv_id) if inv_id.isdigit() else inv_id)
-    summ= _filter_by_invoice(sheets["Summary"],int(inv_id) if inv_id.isdigit() else inv_id)
-    ext = _filter_by_invoice(sheets["Extrinsics"],  int(inv_id) if inv_id.isdigit() else inv_id)
+# Índices dentro de <ds:Signature> de los nodos que cambian por factura
+_SIG_IDX_SIGNED_INFO_OBJECT = 3    # <ds:Object><cXMLSignedInfo payloadID=.../></ds:Object>
+# Id del <Request> firmado: lo referencia <ds:Reference URI="#cXMLData">
+SIGNED_DATA_ID = "cXMLData"
 
-    print(f"Generando cXML para InvoiceID={inv_id} ")
-
-
-    payloadID = _text_or_none(_first_value(env, ALIAS_ENV["payload_id"], f"auto_{pd.Timestamp.now().timestamp()}"))
-    timestamp = _text_or_none(_first_value(env, ALIAS_ENV["timestamp"], pd.Timestamp.now().isoformat()))
-    version   = _text_or_none(_first_value(env, ALIAS_ENV["version"], "1.2.045"))
-
-    cxml = ET.Element("cXML", attrib=_attrib_if_not_none(
-        payloadID=_text_or_none(_first_value(env, ALIAS_ENV["payload_id"], f"auto_{pd.Timestamp.now().timestamp()}")),
-        signatureVersion=_text_or_none(_first_value(env, ALIAS_ENV["signature_version"], "1.0")),
-        timestamp=_text_or_none(_first_value(env, ALIAS_ENV["timestamp"], pd.Timestamp.now().isoformat())),
-        version=_text_or_none(_first_value(env, ALIAS_ENV["version"], "1.2.045")),
-    ))
-
-    # Header (From/To/Sender)
-    hdr_el ,inv_req= _section_header_and_request(cxml, env, hdr, prt, ext, inv_id)
-
-
-    # inv_req = ET.SubElement(Request, "InvoiceDetailRequest")
-
-    # ---- Order + Items
-    order_el = ET.SubElement(inv_req, "InvoiceDetailOrder")
-
-        # if oid_col:
-
-    oi = ET.SubElement(order_el, "InvoiceDetailOrderInfo")
-    ET.SubElement(oi, "OrderIDInfo", attrib={"orderID": str(_first_value(oin, ALIAS_OI["order_id"], ""))})
-
-    # Items
-
-    item = _section_items(it,order_el,'20251010')
-
-    # ---- Taxes
-    # tax_section = _section_tax(tax,summ=summ,item=item,inv_date=inv_date)
-
-    # ---- Summary
-    # _section_summary(inv_req=inv_req,summ=summ,tax=tax,tax_el=tax_section)
-    _section_summary_from_items(inv_req, it, lang="de-CH", fallback_currency='US')
-
-
-    ds_signature = ET.SubElement(cxml,'ds:Signature', attrib={'Id':'cxMLData','xmlns:xades':'http://uri.etsi.org/01903/v1.3.2#','xmlns:ds':'http://www.w3.org/2000/09/xmldsig#'})
+@lru_cache(maxsize=1)
+def _signature_template() -> ET.Element:
+    """
+    Bloque <ds:Signature>/<xades:QualifyingProperties> construido una sola vez por proceso.
+    Casi todo es constante (certificados, políticas, URIs de algoritmos); cada factura
+    recibe un clon con su payloadID (ver _signature_for). No modificar la plantilla.
+    """
+    ds_signature = ET.Element('ds:Signature', attrib={'Id':'cxMLData','xmlns:xades':'http://uri.etsi.org/01903/v1.3.2#','xmlns:ds':'http://www.w3.org/2000/09/xmldsig#'})
 
     ds_signature_info = ET.SubElement(ds_signature,'ds:SignedInfo')
     ds_canonicalization_text = {'Algorithm':'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'}
@@ -1281,7 +1635,7 @@ def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame]) -> ET.Elemen
     DigestValue_text = "0opEEXCsU2BrSLBj+3RXOrYxwmyA/jmMudS4ug1MeCk="
     ds_digest_value = ET.SubElement(ds_reference,'ds:DigestValue').text = DigestValue_text
 
-    ds_reference2 = ET.SubElement(ds_signature_info,'ds:Reference', attrib={'URI':'#cXMLData'})
+    ds_reference2 = ET.SubElement(ds_signature_info,'ds:Reference', attrib={'URI':'#' + SIGNED_DATA_ID})
     ds_digest_method2_text = 'http://www.w3.org/2001/04/xmlenc#sha256'
     ds_digest_method2 = ET.SubElement(ds_reference2,'ds:DigestMethod', attrib={'Algorithm': ds_digest_method2_text})
     DigestValue2_text = "+G52GpooH0fhOqf65yXngrAva31NfZVTaE33z/1DJJU="
@@ -1308,7 +1662,7 @@ def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame]) -> ET.Elemen
     
     ds_signature_inf = ET.SubElement(ds_signature,'ds:Object')
 
-    cXMLSignedInfo = ET.SubElement(ds_signature_inf,'cXMLSignedInfo', attrib={'Id':'cXMLSignedInfo', 'payloadID': payloadID,
+    cXMLSignedInfo = ET.SubElement(ds_signature_inf,'cXMLSignedInfo', attrib={'Id':'cXMLSignedInfo', 'payloadID': '',
                                                                     'signatureVersion':'1.0'})
 
 
@@ -1326,10 +1680,6 @@ def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame]) -> ET.Elemen
     
 
 
-    NS_DS    = "http://www.w3.org/2000/09/xmldsig#"
-    NS_XADES = "http://uri.etsi.org/01903/v1.3.2#"
-    ET.register_namespace("ds", NS_DS)
-    ET.register_namespace("xades", NS_XADES)
     Object = ET.SubElement(ds_signature,'ds:Object')
 
 
@@ -1420,39 +1770,271 @@ def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame]) -> ET.Elemen
     arch_ts = ET.SubElement(usp, 'xades:ArchiveTimeStamp')
     ET.SubElement(arch_ts, 'xades:EncapsulatedTimeStamp').text = ENCAPSULATED_ARCHIVE_TIMESTAMP
 
+    return ds_signature
+
+
+def _signature_for(payload_id: str) -> ET.Element:
+    """Clon de la plantilla de firma con el payloadID de la factura."""
+    sig = copy.deepcopy(_signature_template())
+    sig[_SIG_IDX_SIGNED_INFO_OBJECT][0].set("payloadID", payload_id)
+    return sig
+
+
+def build_cxml_for_invoice(inv_id, sheets: Dict[str, pd.DataFrame], defer_items: bool = False,
+                           indexes: Optional[Dict[str, SnapshotIndex]] = None) -> ET.ElementTree:
+    """
+    Construye el árbol cXML de una factura.
+    Con `defer_items=True` las líneas no se añaden: queda un marcador
+    (_ITEMS_PLACEHOLDER) donde _write_cxml_streaming las escribe directamente al archivo.
+    `indexes` (ver index_sheets) evita recorrer cada hoja completa cuando contiene muchas facturas.
+    """
+    inv_id = str(inv_id)
+    indexes = indexes or {}
+    env = _filter_by_invoice(sheets["Envelope"], int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Envelope"))
+    hdr = _filter_by_invoice(sheets["Header"], int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Header"))
+    prt = _filter_by_invoice(sheets["Partners"], int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Partners"))
+    # idr = _filter_by_invoice(sheets["IdRefs"], inv_id)
+    # oin = _filter_by_invoice(sheets["OrderInfo"], int(inv_id) if inv_id.isdigit() else inv_id)
+    oin = pd.DataFrame()
+    it  = _filter_by_invoice(sheets["Items"], int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Items"))
+    # tax = _filter_by_invoice(sheets["Taxes"], int(inv_id) if inv_id.isdigit() else inv_id)
+    summ= _filter_by_invoice(sheets["Summary"],int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Summary"))
+    ext = _filter_by_invoice(sheets["Extrinsics"],  int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Extrinsics"))
+
+    print(f"Generando cXML para InvoiceID={inv_id} ")
+
+
+    env_plan = _column_plan(env, "env")
+    payloadID = _text_or_none(_plan_value(env, env_plan, "payload_id", f"auto_{pd.Timestamp.now().timestamp()}"))
+    timestamp = _text_or_none(_plan_value(env, env_plan, "timestamp", pd.Timestamp.now().isoformat()))
+    version   = _text_or_none(_plan_value(env, env_plan, "version", "1.2.045"))
+
+    cxml = ET.Element("cXML", attrib=_attrib_if_not_none(
+        payloadID=_text_or_none(_plan_value(env, env_plan, "payload_id", f"auto_{pd.Timestamp.now().timestamp()}")),
+        signatureVersion=_text_or_none(_plan_value(env, env_plan, "signature_version", "1.0")),
+        timestamp=_text_or_none(_plan_value(env, env_plan, "timestamp", pd.Timestamp.now().isoformat())),
+        version=_text_or_none(_plan_value(env, env_plan, "version", "1.2.045")),
+    ))
+
+    # Header (From/To/Sender)
+    hdr_el ,inv_req= _section_header_and_request(cxml, env, hdr, prt, ext, inv_id)
+
+
+    # inv_req = ET.SubElement(Request, "InvoiceDetailRequest")
+
+    # ---- Order + Items
+    order_el = ET.SubElement(inv_req, "InvoiceDetailOrder")
+
+        # if oid_col:
+
+    oi = ET.SubElement(order_el, "InvoiceDetailOrderInfo")
+    ET.SubElement(oi, "OrderIDInfo", attrib={"orderID": str(_first_value(oin, ALIAS_OI["order_id"], ""))})
+
+    # Items
+    if defer_items:
+        ET.SubElement(order_el, _ITEMS_PLACEHOLDER)
+        item = None
+    else:
+        item = _section_items(it,order_el,ITEMS_INV_DATE)
+
+    # ---- Taxes
+    # tax_section = _section_tax(tax,summ=summ,item=item,inv_date=inv_date)
+
+    # ---- Summary
+    # _section_summary(inv_req=inv_req,summ=summ,tax=tax,tax_el=tax_section)
+    _section_summary_from_items(inv_req, it, lang="de-CH", fallback_currency='US')
+
+
+    # ---- Firma: plantilla precompilada, solo cambia el payloadID
+    cxml.append(_signature_for(payloadID))
+
     # dump_xml(cxml, include_doctype=True)       # 👈 imprímelo aquí
 
     return ET.ElementTree(cxml)
 
 
 
-def generate_all_cxml(sheets: Dict[str, pd.DataFrame], output_prefix="./salida/invoice_"):
+def _write_cxml(root: ET.Element, out: str):
+    xml_body = tostring(root, encoding="utf-8")
+
+    with open(out, "wb") as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write((DOCTYPE + "\n").encode("utf-8"))
+        f.write(xml_body)
+
+
+def _write_cxml_streaming(inv_id, sheets: Dict[str, pd.DataFrame], out: str,
+                          indexes: Optional[Dict[str, SnapshotIndex]] = None):
+    """
+    Igual que _write_cxml(build_cxml_for_invoice(...)) pero sin tener las líneas en memoria:
+    el esqueleto (cabecera, resumen, firma) se serializa una vez y cada
+    <InvoiceDetailItem> se escribe al archivo en cuanto se genera.
+    El resultado es idéntico byte a byte.
+    """
+    indexes = indexes or {}
+    tree = build_cxml_for_invoice(inv_id, sheets, defer_items=True, indexes=indexes)
+    skeleton = tostring(tree.getroot(), encoding="utf-8")
+    head, tail = skeleton.split(f"<{_ITEMS_PLACEHOLDER} />".encode("utf-8"), 1)
+
+    inv_id = str(inv_id)
+    it = _filter_by_invoice(sheets["Items"], int(inv_id) if inv_id.isdigit() else inv_id, indexes.get("Items"))
+
+    with open(out, "wb") as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write((DOCTYPE + "\n").encode("utf-8"))
+        f.write(head)
+        for item in _iter_item_elements(it, ITEMS_INV_DATE):
+            f.write(tostring(item, encoding="utf-8"))
+        f.write(tail)
+
+
+def _header_invoice_ids(sheets: Dict[str, pd.DataFrame]) -> list:
+    """InvoiceIDs (como texto, igual que en el nombre del archivo) de la hoja Header."""
     hdr = sheets["Header"]
     inv_col = _find_col(hdr, ['invoice_id',"invoiceid", "InvoiceID",'invoice_id'])
     if not inv_col:
         raise ValueError("La hoja 'Header' debe contener 'InvoiceID'")
+    return hdr[inv_col].dropna().astype(str).unique().tolist()
 
-    invoice_ids = hdr[inv_col].dropna().astype(str).unique().tolist()
 
+def generate_all_cxml(sheets: Dict[str, pd.DataFrame], output_prefix="./salida/invoice_", stream: bool = False) -> list:
+    """
+    Genera un archivo cXML por InvoiceID de la hoja Header. Devuelve las rutas escritas.
+    `stream=True` escribe las líneas directamente al archivo (memoria constante
+    para facturas con muchas líneas); la salida es la misma.
+    """
+    invoice_ids = _header_invoice_ids(sheets)
+    # Hojas multi-factura (p.ej. Excel): se indexan una vez en vez de filtrarlas por cada factura
+    indexes = index_sheets(sheets) if len(invoice_ids) > 1 else None
+
+    written = []
     for inv_id in invoice_ids:
-        tree_or_root = build_cxml_for_invoice(inv_id, sheets)
-        # Soporta si devuelves ElementTree o directamente Element
-        root = tree_or_root.getroot() if hasattr(tree_or_root, "getroot") else tree_or_root
-        print(inv_id)
-        print(root)
         out = f"{output_prefix}{inv_id}.xml"
-        xml_body = tostring(root, encoding="utf-8")
-
-        with open(out, "wb") as f:
-            f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
-            f.write((DOCTYPE + "\n").encode("utf-8"))
-            f.write(xml_body)
+        if stream:
+            print(inv_id)
+            _write_cxml_streaming(inv_id, sheets, out, indexes=indexes)
+        else:
+            tree_or_root = build_cxml_for_invoice(inv_id, sheets, indexes=indexes)
+            # Soporta si devuelves ElementTree o directamente Element
+            root = tree_or_root.getroot() if hasattr(tree_or_root, "getroot") else tree_or_root
+            print(inv_id)
+            print(root)
+            _write_cxml(root, out)
+        written.append(out)
         print(f"✅ XML generado: {out}")
+    return written
+
+
+# Estado de solo lectura de cada worker del pool (lo fija _init_cxml_worker)
+_WORKER_SNAPSHOT = None
+_WORKER_DETAILS = None
+_WORKER_CACHE_DIR = None            # directorio del CxmlCache (None = sin caché)
+_WORKER_CACHE_KEYS = frozenset()    # claves presentes en el caché al empezar la corrida
+
+def _init_cxml_worker(snapshot: SnapshotIndex, details: Optional[Dict[int, pd.DataFrame]],
+                      cache_dir: Optional[str] = None, cache_keys: frozenset = frozenset()):
+    global _WORKER_SNAPSHOT, _WORKER_DETAILS, _WORKER_CACHE_DIR, _WORKER_CACHE_KEYS
+    # Con fork el pool del padre se hereda: cada worker abre sus propias conexiones si las necesita
+    dispose_engines()
+    _WORKER_SNAPSHOT = snapshot
+    _WORKER_DETAILS = details
+    _WORKER_CACHE_DIR = cache_dir
+    _WORKER_CACHE_KEYS = cache_keys
+
+def _generate_cxml_chunk(invoice_ids: list, output_prefix: str, stream: bool = False) -> list:
+    """[(invoice, rutas, clave de caché o None, reutilizado del caché)] por factura."""
+    results = []
+    for invoice in invoice_ids:
+        sheets = build_sheets_from_snapshot(_WORKER_SNAPSHOT, invoice, details=_WORKER_DETAILS)
+        key = sheets_digest(sheets) if _WORKER_CACHE_DIR else None
+        if key is not None and key in _WORKER_CACHE_KEYS:
+            paths = []
+            for inv_id in _header_invoice_ids(sheets):
+                out = f"{output_prefix}{inv_id}.xml"
+                shutil.copyfile(blob_path(_WORKER_CACHE_DIR, key), out)
+                paths.append(out)
+            print(f"♻️  XML sin cambios (caché): {invoice}")
+            results.append((invoice, paths, key, True))
+        else:
+            results.append((invoice, generate_all_cxml(sheets, output_prefix=output_prefix, stream=stream), key, False))
+    return results
+
+def generate_cxml_parallel(snapshot,
+                           invoice_ids,
+                           details: Optional[Dict[int, pd.DataFrame]] = None,
+                           workers: Optional[int] = None,
+                           chunk_size: int = 50,
+                           output_prefix: str = "./salida/",
+                           stream: bool = False,
+                           cache: Optional[CxmlCache] = None) -> Dict:
+    """
+    Reparte `invoice_ids` en bloques de `chunk_size` sobre un ProcessPoolExecutor.
+    `snapshot` es el DataFrame de good_to_pay o un SnapshotIndex ya construido.
+    Cada worker recibe una sola vez el snapshot indexado y el índice de detalle (solo lectura)
+    y escribe `<output_prefix><InvoiceID>.xml`, igual que generate_all_cxml.
+    Con `cache`, las facturas cuyas hojas no cambiaron se copian del caché sin renderizar;
+    la clave de cada factura queda en `cache.run_keys` (para decidir si se reenvía).
+    Devuelve {invoice_id: [rutas generadas]} en el mismo orden que `invoice_ids`.
+    """
+    ids = list(invoice_ids)
+    chunk_size = max(1, chunk_size)
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    # Se indexa una vez aquí; cada worker recibe el snapshot ya ordenado
+    if not isinstance(snapshot, SnapshotIndex):
+        snapshot = SnapshotIndex(snapshot)
+    initargs = (snapshot, details,
+                cache.cache_dir if cache is not None else None,
+                cache.keys() if cache is not None else frozenset())
+
+    if workers == 1 or len(chunks) <= 1:
+        _init_cxml_worker(*initargs)
+        results = [_generate_cxml_chunk(chunk, output_prefix, stream) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 initializer=_init_cxml_worker,
+                                 initargs=initargs) as pool:
+            results = list(pool.map(_generate_cxml_chunk, chunks, repeat(output_prefix), repeat(stream)))
+
+    # El caché solo lo escribe este proceso
+    if cache is not None:
+        for chunk in results:
+            for invoice, paths, key, hit in chunk:
+                cache.run_keys[invoice] = key
+                if hit:
+                    cache.touch(key)
+                elif paths:
+                    cache.put_file(key, paths[0], invoice_id=int(invoice))
+        cache.save()
 
+    return {invoice: paths for chunk in results for invoice, paths, _, _ in chunk}
 
 
 
-def send_xml_file(xml_path: str, url: str = "http://localhost:8000/cxml"):
+
+SEND_URL = "http://localhost:8000/cxml"
+
+def _make_send_session(max_in_flight: int = 8) -> requests.Session:
+    """
+    Session keep-alive con un pool por host del tamaño de los envíos simultáneos.
+    Solo se fija pool_maxsize: todos los envíos van al mismo host (SEND_URL / --url),
+    así que pool_connections (nº de hosts con pool cacheado) se deja por defecto.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_in_flight)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def send_xml_file(xml_path: str, url: str = SEND_URL,
+                  session: Optional[requests.Session] = None,
+                  gzip_body: bool = False,
+                  timeout: float = 60,
+                  attachment_dir: Optional[str] = None):
+    """
+    Con `attachment_dir`, si el cXML referencia PDFs (cid:) presentes en ese directorio
+    se envía como multipart/related en streaming (ver mime_package); si no, el XML solo.
+    """
     p = Path(xml_path)
     if not p.is_file():
         raise FileNotFoundError(f"No existe el archivo: {p}")
@@ -1462,39 +2044,267 @@ def send_xml_file(xml_path: str, url: str = "http://localhost:8000/cxml"):
         "User-Agent": "Python requests",
         "Content-Type": "application/xml",
     }
-
-    # Envía el contenido del archivo sin modificar
-    with p.open("rb") as f:
-        resp = requests.post(url, data=f, headers=headers, timeout=60)
+    poster = session or requests
+    package = package_cxml(str(p), attachment_dir) if attachment_dir else None
+
+    if package is not None:
+        # Cuerpo iterable con __len__: requests lo envía por bloques con Content-Length.
+        # Sin gzip: comprimirlo obligaría a tener el mensaje entero en memoria.
+        headers["Content-Type"] = package.content_type
+        resp = poster.post(url, data=package, headers=headers, timeout=timeout)
+    elif gzip_body:
+        headers["Content-Encoding"] = "gzip"
+        resp = poster.post(url, data=gzip.compress(p.read_bytes()), headers=headers, timeout=timeout)
+    else:
+        # Envía el contenido del archivo sin modificar
+        with p.open("rb") as f:
+            resp = poster.post(url, data=f, headers=headers, timeout=timeout)
 
     print(f"HTTP {resp.status_code}")
     print(resp.text)
     return resp
 
 
+def send_xml_files(xml_paths, url: str = SEND_URL,
+                   max_in_flight: int = 8,
+                   gzip_body: bool = False,
+                   timeout: float = 60,
+                   attachment_dir: Optional[str] = None) -> list:
+    """
+    Envía muchos cXML en paralelo (como máximo `max_in_flight` a la vez) reutilizando
+    las conexiones de una Session compartida.
+    `xml_paths`: lista de pares (invoice_id, ruta) —una factura puede tener varios
+    archivos—, {invoice_id: ruta} o lista de rutas (invoice_id = nombre del archivo).
+    Devuelve un dict por archivo: invoice_id, path, status_code, text, error.
+    Los errores de red no cortan el lote: quedan con status_code=None y `error`.
+    """
+    if isinstance(xml_paths, dict):
+        pairs = list(xml_paths.items())
+    else:
+        pairs = [tuple(p) if isinstance(p, (tuple, list)) else (Path(p).stem, p) for p in xml_paths]
+
+    session = _make_send_session(max_in_flight)
+
+    def _send_one(pair):
+        invoice_id, path = pair
+        try:
+            resp = send_xml_file(path, url, session=session, gzip_body=gzip_body, timeout=timeout,
+                                 attachment_dir=attachment_dir)
+            return {"invoice_id": invoice_id, "path": str(path), "status_code": resp.status_code,
+                    "text": resp.text, "error": None}
+        except (requests.RequestException, OSError) as e:
+            return {"invoice_id": invoice_id, "path": str(path), "status_code": None,
+                    "text": "", "error": str(e)}
+
+    with session, ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        return list(pool.map(_send_one, pairs))
+
+
+
+# ---------------------------------------------------------------------------
+# Modo incremental: marca de agua sobre update_datetime de good_to_pay
+# ---------------------------------------------------------------------------
+
+ACTIVE_WHERE = "COALESCE(record_active_ind,'Y')='Y'"
+WATERMARK_PATH = os.environ.get("EXAMIN_WATERMARK", "./salida/.good_to_pay.watermark")
+# Estados que escribe el propio proceso (update_status): también mueven update_datetime,
+# así que se excluyen para no reenviar en cada corrida lo ya enviado o rechazado.
+# Para reintentar los ERROR: --full o cambiar su record_status.
+INCREMENTAL_SKIP_STATUSES = ["SENT", "ERROR"]
+
+
+def read_watermark(path: str = WATERMARK_PATH) -> Optional[pd.Timestamp]:
+    """Última marca de agua guardada (None si no hay: primera corrida => carga completa)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = f.read().strip()
+    except FileNotFoundError:
+        return None
+    ts = pd.to_datetime(raw, errors="coerce")
+    return None if pd.isna(ts) else ts
 
-snapshot = load_data(
-    table="good_to_pay",
-    where="COALESCE(record_active_ind,'Y')='Y'"
-)
 
+def write_watermark(ts, path: str = WATERMARK_PATH):
+    """Guarda la marca de agua de forma atómica (tmp + rename)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(pd.Timestamp(ts).isoformat())
+    os.replace(tmp, path)
 
-invoice_ids =  [40766]# sorted(snapshot["invoice_id"].dropna().unique().tolist())
-sheets =None
-for invoice in invoice_ids:
-    sheets = build_sheets_from_snapshot(snapshot=snapshot,invoice_id=invoice)
 
-    generate_all_cxml(sheets, output_prefix="./salida/")
-    response = send_xml_file(f"./salida/{str(40766.0)}.xml")    
-    print(response.text)
-    if response.status_code  in [406]:
-        df = pd.DataFrame(sheets['Header'])
-        print('needs to update the goodtopay table')
-        update_status(response.status_code,response.text,df)
+def db_now() -> pd.Timestamp:
+    """Hora del servidor de BD (la misma referencia que NOW() en update_datetime)."""
+    with get_connection('').connect() as con:
+        return pd.Timestamp(con.execute(text("SELECT NOW()")).scalar())
 
 
+def snapshot_filter(since=None):
+    """
+    (where, params) para good_to_pay: activas y, si hay `since`, solo las nuevas o
+    modificadas después de la marca de agua que no estén ya SENT/ERROR.
+    """
+    if since is None:
+        return ACTIVE_WHERE, None
+    where = (ACTIVE_WHERE
+             + " AND COALESCE(update_datetime, add_datetime) > :since"
+             + " AND COALESCE(record_status,'') <> ALL(:skip_statuses)")
+    return where, {"since": pd.Timestamp(since).to_pydatetime(), "skip_statuses": INCREMENTAL_SKIP_STATUSES}
 
 
+# Respuestas cuyo estado se registra en good_to_pay: 200/201 -> SENT, 406 -> ERROR
+STATUS_RECORDED_CODES = STATUS_OK_CODES + (406,)
 
 
+def failed_sends(results) -> list:
+    """
+    Resultados que impiden avanzar la marca de agua: los que no dejan estado en
+    good_to_pay (error de red/firma, HTTP 400/500/503...). Las facturas sin estado
+    registrado siguen siendo seleccionables solo mientras la marca de agua no pase
+    de ellas; las SENT/ERROR ya las excluye snapshot_filter.
+    """
+    return [r for r in results if r["error"] or r["status_code"] not in STATUS_RECORDED_CODES]
+
 
+def recordable_results(results) -> list:
+    """
+    Resultados a registrar con update_status_bulk. Una factura con algún envío sin
+    estado (p.ej. una hoja con 503) no se marca SENT por sus otras hojas: así la
+    siguiente corrida la vuelve a seleccionar.
+    """
+    pending = {r["invoice_id"] for r in failed_sends(results)}
+    return [r for r in results
+            if not r["error"] and r["status_code"] in STATUS_RECORDED_CODES
+            and (r["status_code"] not in STATUS_OK_CODES or r["invoice_id"] not in pending)]
+
+
+def run_batch(snapshot: pd.DataFrame, invoice_ids, args, cache: Optional[CxmlCache] = None):
+    """
+    Genera, (firma), envía y actualiza el estado de `invoice_ids` a partir de `snapshot`.
+    Con `cache`, las facturas sin cambios ya enviadas con éxito no se vuelven a enviar.
+    Devuelve los resultados de send_xml_files.
+    """
+    snapshot = SnapshotIndex(snapshot)
+    details = load_invoice_details(invoice_ids)
+    generated = generate_cxml_parallel(snapshot, invoice_ids, details=details,
+                                       workers=args.workers, chunk_size=args.chunk_size,
+                                       output_prefix=args.outdir, stream=args.stream,
+                                       cache=cache)
+
+    if cache is not None:
+        unchanged = [inv for inv in generated if cache.is_sent(cache.run_keys.get(inv))]
+        if unchanged:
+            print(f"[cache] {len(unchanged)} facturas sin cambios ya enviadas: no se reenvían")
+            generated = {inv: paths for inv, paths in generated.items() if inv not in set(unchanged)}
+
+    if args.sign_key:
+        from xml_signing import sign_files
+        signed = sign_files([p for paths in generated.values() for p in paths], args.sign_key, args.sign_cert,
+                            workers=args.workers, chunk_size=args.chunk_size)
+        failed = {p: err for p, err in signed if err}
+        for p, err in failed.items():
+            print(f"[sign] {p}: {err}")
+        sign_errors = [{"invoice_id": invoice, "path": p, "status_code": None, "text": "", "error": f"firma: {failed[p]}"}
+                       for invoice, paths in generated.items() for p in paths if p in failed]
+        generated = {invoice: [p for p in paths if p not in failed] for invoice, paths in generated.items()}
+    else:
+        sign_errors = []
+
+    to_send = [(invoice, path) for invoice, paths in generated.items() for path in paths]
+    results = send_xml_files(to_send, url=args.url, max_in_flight=args.max_in_flight, gzip_body=args.gzip,
+                             attachment_dir=args.attach_dir)
+
+    for res in results:
+        if res["error"]:
+            print(f"[send] {res['path']}: {res['error']}")
+
+    # SENT (200/201) y ERROR (406) en una sola transacción: snapshot_filter las excluye
+    # en la siguiente corrida incremental aunque la marca de agua no avance
+    statuses = []
+    for res in recordable_results(results):
+        head = snapshot.first(res["invoice_id"])
+        statuses.append((res["invoice_id"], res["status_code"], res["text"],
+                         head.get("invoice_date") if head is not None else None))
+    if statuses:
+        update_status_bulk(statuses)
+
+    if cache is not None:
+        for res in sign_errors + results:
+            key = cache.run_keys.get(res["invoice_id"])
+            if not res["error"] and res["status_code"] in (200, 201):
+                cache.mark_sent(key)
+            else:
+                cache.invalidate(key)
+        cache.save()
+    return sign_errors + results
+
+
+def _positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"debe ser >= 1: {value}")
+    return n
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Genera y envía cXML desde good_to_pay")
+    ap.add_argument("--invoice", nargs="*", type=int, help="InvoiceIDs a procesar (por defecto todos los activos)")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos para generar XML (por defecto: núcleos)")
+    ap.add_argument("--chunk-size", type=_positive_int, default=50, help="Facturas por tarea del pool (>= 1)")
+    ap.add_argument("--outdir", default="./salida/", help="Prefijo/directorio de salida")
+    ap.add_argument("--stream", action="store_true", help="Escribe las líneas directamente al archivo (facturas grandes)")
+    ap.add_argument("--url", default=SEND_URL, help="Endpoint cXML de destino")
+    ap.add_argument("--max-in-flight", type=int, default=8, help="Envíos HTTP simultáneos")
+    ap.add_argument("--gzip", action="store_true", help="Comprime el cuerpo (Content-Encoding: gzip)")
+    ap.add_argument("--attach-dir", default=None,
+                    help="Directorio con los PDF (<cid>.pdf): envía multipart/related con los adjuntos")
+    ap.add_argument("--sign-key", default=None, help="Clave RSA (PEM) para firmar los XML antes de enviarlos")
+    ap.add_argument("--sign-cert", default=None, help="Certificado X.509 que se incluye en <ds:X509Certificate>")
+    ap.add_argument("--snapshot-chunk", type=int, default=0,
+                    help="Lee good_to_pay en streaming en bloques de N filas (0 = todo de una vez)")
+    ap.add_argument("--cache", default=None,
+                    help="Directorio del caché de cXML (omite renderizar/reenviar facturas sin cambios)")
+    ap.add_argument("--full", action="store_true", help="Ignora la marca de agua y procesa todo lo activo")
+    ap.add_argument("--watermark", default=WATERMARK_PATH, help="Archivo de la marca de agua (update_datetime)")
+    args = ap.parse_args()
+
+    # Incremental por defecto; --full o --invoice cargan todo lo activo y,
+    # solo en una corrida completa sin errores de envío, se avanza la marca de agua.
+    adhoc = bool(args.invoice)
+    since = None if (args.full or adhoc) else read_watermark(args.watermark)
+    run_started = None if adhoc else db_now()
+    where, params = snapshot_filter(since)
+    print(f"[good_to_pay] {'incremental desde ' + since.isoformat() if since is not None else 'carga completa'}")
+
+    cache = CxmlCache(args.cache) if args.cache else None
+
+    results = []
+    if args.snapshot_chunk:
+        # Streaming: se procesa cada bloque de facturas mientras llega el siguiente
+        wanted = set(args.invoice) if args.invoice else None
+        for part in prefetch(iter_load_data(
+                table="good_to_pay",
+                where=where,
+                params=params,
+                chunksize=args.snapshot_chunk)):
+            ids = sorted(part["invoice_id"].dropna().unique().tolist())
+            if wanted is not None:
+                ids = [i for i in ids if int(i) in wanted]
+            if ids:
+                results.extend(run_batch(part, ids, args, cache))
+    else:
+        snapshot = load_data(
+            table="good_to_pay",
+            where=where,
+            params=params,
+        )
+        invoice_ids = args.invoice or sorted(snapshot["invoice_id"].dropna().unique().tolist())
+        if invoice_ids:
+            results = run_batch(snapshot, invoice_ids, args, cache)
+
+    failed = failed_sends(results)
+    if run_started is not None and not failed:
+        write_watermark(run_started, args.watermark)
+        print(f"[good_to_pay] marca de agua -> {run_started.isoformat()}")
+    elif failed:
+        print(f"[good_to_pay] {len(failed)} envíos fallidos: la marca de agua no se mueve")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_parse_cxml.py
+
+Micro-benchmark de parse_cxml_to_dfs sobre los cXML de `Sample cXML/`, con las
+líneas (InvoiceDetailItem) replicadas hasta N por archivo.
+
+Compara la extracción de líneas de una sola pasada (_item_row) con la versión
+anterior basada en it.find("A/B/...") por campo (referencia incluida aquí) y
+comprueba que ambas devuelven exactamente las mismas filas. Mide además
+parse_cxml (DOM) y parse_cxml_stream (iterparse) completos.
+
+Uso:
+  python bench_parse_cxml.py --lines 10000 --repeat 3
+"""
+
+import argparse
+import copy
+import glob
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+import parse_cxml_to_dfs as pcx
+
+
+def _item_row_paths(it, order_id):
+    """Referencia: un find() con ruta por campo (recorre el subárbol de nuevo en cada uno)."""
+    _text, _attr = pcx._text, pcx._attr
+    row = {"order_id": order_id}
+    row["invoiceLineNumber"] = _attr(it, "invoiceLineNumber")
+    row["quantity"] = _attr(it, "quantity")
+    row["unitOfMeasure"] = _text(it.find("UnitOfMeasure"))
+    m_price = it.find("UnitPrice/Money")
+    row["unitPrice"] = _text(m_price)
+    row["unitPrice_currency"] = _attr(m_price, "currency")
+    ref = it.find("InvoiceDetailItemReference")
+    row["ref_lineNumber"] = _attr(ref, "lineNumber")
+    row["description"] = _text(it.find("InvoiceDetailItemReference/Description"))
+    m_sub = it.find("SubtotalAmount/Money")
+    row["subtotal"] = _text(m_sub)
+    row["subtotal_currency"] = _attr(m_sub, "currency")
+    acc_seg = it.find("Distribution/Accounting/AccountingSegment")
+    row["dist_accounting_id"] = _attr(acc_seg, "id")
+    row["dist_accounting_name"] = _text(it.find("Distribution/Accounting/AccountingSegment/Name"))
+    row["dist_accounting_desc"] = _text(it.find("Distribution/Accounting/AccountingSegment/Description"))
+    m_charge = it.find("Distribution/Charge/Money")
+    if m_charge is not None:
+        row["dist_charge_amount"] = _text(m_charge)
+        row["dist_charge_currency"] = _attr(m_charge, "currency")
+        row["dist_charge_alt_amount"] = _attr(m_charge, "alternateAmount")
+        row["dist_charge_alt_currency"] = _attr(m_charge, "alternateCurrency")
+    return row
+
+
+def _items_with(root, row_fn):
+    rows = []
+    for order in root.findall("Request/InvoiceDetailRequest/InvoiceDetailOrder"):
+        info = order.find("InvoiceDetailOrderInfo/OrderIDInfo")
+        order_id = pcx._attr(info, "orderID")
+        for it in order.findall("InvoiceDetailItem"):
+            rows.append(row_fn(it, order_id))
+    return rows
+
+
+def scale_sample(src: str, dst: str, lines: int) -> bool:
+    """Escribe `src` con su primer InvoiceDetailItem replicado hasta `lines` líneas. False si no aplica."""
+    try:
+        tree = ET.parse(src)
+    except ET.ParseError:
+        return False
+    order = tree.getroot().find("Request/InvoiceDetailRequest/InvoiceDetailOrder")
+    template = order.find("InvoiceDetailItem") if order is not None else None
+    if template is None:
+        return False
+    for it in order.findall("InvoiceDetailItem"):
+        order.remove(it)
+    for n in range(1, lines + 1):
+        it = copy.deepcopy(template)
+        it.set("invoiceLineNumber", str(n))
+        order.append(it)
+    tree.write(dst, encoding="UTF-8", xml_declaration=True)
+    return True
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de parse_header/parse_items/parse_summary")
+    ap.add_argument("--samples", default="Sample cXML", help="Directorio con los cXML de ejemplo")
+    ap.add_argument("--lines", type=int, default=10000, help="Líneas por archivo escalado")
+    ap.add_argument("--repeat", type=int, default=3, help="Repeticiones (se toma la mejor)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_parse_")
+    try:
+        print(f"{'archivo':<22} {'find() s':>9} {'1 pasada s':>11} {'x':>5} {'parse_cxml s':>13} {'stream s':>9}")
+        for src in sorted(glob.glob(os.path.join(args.samples, "*.xml"))):
+            name = os.path.basename(src)
+            dst = os.path.join(tmp, name)
+            if not scale_sample(src, dst, args.lines):
+                print(f"{name:<22} (omitido: no parsea o sin líneas)")
+                continue
+
+            root = ET.parse(dst).getroot()
+            if _items_with(root, _item_row_paths) != pcx.parse_items(root):
+                print(f"{name:<22} DIFERENCIA entre implementaciones")
+                continue
+
+            t_paths = _best(lambda: _items_with(root, _item_row_paths), args.repeat)
+            t_single = _best(lambda: pcx.parse_items(root), args.repeat)
+            t_dom = _best(lambda: pcx.parse_cxml(dst), args.repeat)
+            t_stream = _best(lambda: pcx.parse_cxml_stream(dst), args.repeat)
+            print(f"{name:<22} {t_paths:>9.3f} {t_single:>11.3f} {t_paths / t_single:>5.1f} "
+                  f"{t_dom:>13.3f} {t_stream:>9.3f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_signing.py
+
+Mide firmas/segundo de xml_signing.sign_files con distintos números de workers.
+Genera una clave RSA y un certificado autofirmado de prueba (solo local) y firma
+N copias de un cXML de ejemplo en un directorio temporal.
+
+Uso:
+  python bench_signing.py --input salida/18126.xml --count 2000 --workers 1 2 4 8
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+import xml_signing
+
+
+def make_test_key(out_dir: str, bits: int = 2048):
+    """Escribe key.pem y cert.pem (autofirmado) en `out_dir`. Devuelve (key_path, cert_path)."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=bits)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "examin-bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+
+    key_path = os.path.join(out_dir, "key.pem")
+    cert_path = os.path.join(out_dir, "cert.pem")
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM,
+                                  serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return key_path, cert_path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de firma cXML por número de workers")
+    ap.add_argument("--input", default="salida/18126.xml", help="cXML de ejemplo (con <ds:Signature>)")
+    ap.add_argument("--count", type=int, default=1000, help="Documentos a firmar por ronda")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    ap.add_argument("--chunk-size", type=int, default=50)
+    ap.add_argument("--bits", type=int, default=2048, help="Tamaño de la clave RSA de prueba")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_signing_")
+    try:
+        key_path, cert_path = make_test_key(tmp, args.bits)
+        src_dir = os.path.join(tmp, "src")
+        os.makedirs(src_dir)
+        paths = []
+        for i in range(args.count):
+            p = os.path.join(src_dir, f"{i}.xml")
+            shutil.copyfile(args.input, p)
+            paths.append(p)
+
+        print(f"{args.count} documentos, {os.path.getsize(args.input)} bytes c/u, RSA {args.bits}")
+        print(f"{'workers':>8} {'seg':>8} {'firmas/s':>10}")
+        for w in sorted(set(args.workers)):
+            out_dir = os.path.join(tmp, f"out_{w}")
+            t0 = time.perf_counter()
+            results = xml_signing.sign_files(paths, key_path, cert_path, workers=w,
+                                             chunk_size=args.chunk_size, out_dir=out_dir)
+            elapsed = time.perf_counter() - t0
+            errors = sum(1 for _, e in results if e)
+            print(f"{w:>8} {elapsed:>8.2f} {args.count / elapsed:>10.1f}" + (f"  errores={errors}" if errors else ""))
+
+        # Comprobación: la última salida verifica con la clave pública
+        public_key = xml_signing.load_signing_key(key_path).public_key()
+        with open(results[-1][0], "rb") as f:
+            print("verificación:", "OK" if xml_signing.verify_bytes(f.read(), public_key) else "FALLO")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
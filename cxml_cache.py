@@ -0,0 +1,142 @@
+# cxml_cache.py
+"""
+Caché en disco de los cXML generados, por contenido.
+
+La clave es un SHA-256 de las hojas de entrada normalizadas de la factura
+(Header, Items, Partners, Extrinsics). Si no cambiaron desde la corrida anterior
+se reutilizan los bytes ya generados en vez de volver a renderizar, y si además
+ese contenido ya se envió con éxito, el envío también se omite.
+
+Estructura:
+  <cache_dir>/index.json   orden LRU + metadatos (tamaño, invoice_id, enviado)
+  <cache_dir>/<clave>.xml  bytes generados
+
+Un solo escritor: el proceso principal (generate_cxml_parallel). Los workers solo
+consultan el conjunto de claves presentes y copian el blob.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import pandas as pd
+
+# Hojas que determinan el contenido del cXML (Envelope/Summary se derivan de estas o del reloj)
+CACHE_SHEETS = ("Header", "Items", "Partners", "Extrinsics")
+# Subir cuando cambie la forma de generar el XML: invalida todas las entradas anteriores
+CACHE_RENDER_VERSION = 1
+CACHE_MAX_BYTES = int(os.environ.get("EXAMIN_CXML_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def blob_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"{key}.xml")
+
+
+def _normalized_sheet(df) -> dict:
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return {"columns": [], "rows": []}
+    cols = sorted(df.columns, key=str)
+    values = df[cols].astype(object)
+    values = values.where(values.notna(), None)
+    return {"columns": [str(c) for c in cols], "rows": values.values.tolist()}
+
+
+def sheets_digest(sheets: Dict[str, pd.DataFrame]) -> str:
+    """Hash estable de las hojas de entrada de una factura (columnas en orden, NaN -> null)."""
+    payload = {"v": CACHE_RENDER_VERSION}
+    for name in CACHE_SHEETS:
+        payload[name] = _normalized_sheet(sheets.get(name))
+    raw = json.dumps(payload, default=str, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CxmlCache:
+    """Índice LRU acotado por tamaño total de los blobs."""
+
+    def __init__(self, cache_dir: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        # Clave calculada para cada factura en la corrida actual (la rellena generate_cxml_parallel)
+        self.run_keys: Dict[int, str] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    # ---- índice
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, meta in data.get("entries", []):
+            if os.path.isfile(self.blob_path(key)):
+                self.entries[key] = meta
+                self.total_bytes += meta.get("size", 0)
+
+    def save(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"entries": list(self.entries.items())}, f)
+        os.replace(tmp, self.index_path)
+
+    def blob_path(self, key: str) -> str:
+        return blob_path(self.cache_dir, key)
+
+    def keys(self) -> frozenset:
+        return frozenset(self.entries)
+
+    # ---- consulta / alta
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def touch(self, key: str):
+        meta = self.entries.get(key)
+        if meta is not None:
+            meta["atime"] = time.time()
+            self.entries.move_to_end(key)
+
+    def put_file(self, key: str, path: str, invoice_id=None):
+        """Copia `path` al caché bajo `key` (si ya estaba, solo lo marca como usado)."""
+        if key in self.entries:
+            self.touch(key)
+            return
+        shutil.copyfile(path, self.blob_path(key))
+        size = os.path.getsize(self.blob_path(key))
+        self.entries[key] = {"size": size, "invoice_id": invoice_id, "sent": False, "atime": time.time()}
+        self.total_bytes += size
+        self._evict()
+
+    # ---- estado de envío
+    def is_sent(self, key: Optional[str]) -> bool:
+        meta = self.entries.get(key) if key else None
+        return bool(meta and meta.get("sent"))
+
+    def mark_sent(self, key: Optional[str]):
+        if key in self.entries:
+            self.entries[key]["sent"] = True
+
+    def invalidate(self, key: Optional[str]):
+        """Quita la entrada (p.ej. envío fallido): la próxima corrida regenera y reenvía."""
+        meta = self.entries.pop(key, None) if key else None
+        if meta is None:
+            return
+        self.total_bytes -= meta.get("size", 0)
+        try:
+            os.remove(self.blob_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, meta = self.entries.popitem(last=False)
+            self.total_bytes -= meta.get("size", 0)
+            try:
+                os.remove(self.blob_path(key))
+            except FileNotFoundError:
+                pass
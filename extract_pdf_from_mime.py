@@ -1,8 +1,15 @@
 #!/usr/bin/env python3
-import os, re, base64
+import os, re, base64, binascii, hashlib, csv, glob, shutil
+from concurrent.futures import ProcessPoolExecutor
 from email import policy
 from email.parser import BytesParser
 
+CHUNK_SIZE = 1024 * 1024          # lectura del stream MIME por bloques
+MAX_HEADER_BYTES = 64 * 1024      # cabeceras de una parte (si no aparece fin de línea: no es MIME)
+_B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+_B64_JUNK = bytes(b for b in range(256) if b not in _B64_ALPHABET)
+_HEADER_LINE = re.compile(rb"^[A-Za-z0-9-]+\s*:")
+
 def save_bytes(data: bytes, filename: str, out_dir: str) -> str:
     os.makedirs(out_dir, exist_ok=True)
     path = os.path.join(out_dir, filename)
@@ -62,14 +69,366 @@ def manual_multipart_extract(raw: bytes, out_dir: str):
             pass
     return saved
 
-if __name__ == "__main__":
-    import sys
-    src = sys.argv[1]
-    out_dir = sys.argv[2] if len(sys.argv) > 2 else "out"
+# ---------------------------------------------------------------------------
+# Extractor en streaming: memoria acotada (~CHUNK_SIZE) sin importar el tamaño del PDF
+# ---------------------------------------------------------------------------
+
+class _Sink:
+    """Escribe el cuerpo de una parte a disco (decodificando base64 si aplica) y calcula sha256."""
+
+    def __init__(self, path: str, b64: bool):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.f = open(path, "wb")
+        self.b64 = b64
+        self.pending = b""        # resto < 4 caracteres base64 entre bloques
+        self.size = 0
+        self.sha = hashlib.sha256()
+
+    def _emit(self, data: bytes):
+        if data:
+            self.f.write(data)
+            self.sha.update(data)
+            self.size += len(data)
+
+    def write(self, data: bytes):
+        if not self.b64:
+            return self._emit(data)
+        data = self.pending + data.translate(None, _B64_JUNK)
+        n = len(data) - len(data) % 4
+        self.pending = data[n:]
+        if n:
+            self._emit(binascii.a2b_base64(data[:n]))
+
+    def close(self) -> dict:
+        if self.b64 and self.pending.strip(b"="):
+            tail = self.pending.rstrip(b"=")
+            try:
+                self._emit(binascii.a2b_base64(tail + b"=" * (-len(tail) % 4)))
+            except binascii.Error:
+                pass
+        self.f.close()
+        return {"path": self.path, "size": self.size, "sha256": self.sha.hexdigest()}
+
+
+class _Reader:
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = b""
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def readline(self, limit: int = MAX_HEADER_BYTES):
+        while b"\n" not in self.buf and len(self.buf) < limit and self.fill():
+            pass
+        i = self.buf.find(b"\n")
+        return self.buf[:i + 1] if i >= 0 else self.buf[:limit]
+
+
+def _find_boundary(head: bytes):
+    lines = head.splitlines()
+    delim = next((ln.strip() for ln in lines[:5] if ln.startswith(b"--") and len(ln.strip(b"-")) >= 6), None)
+    if not delim:
+        m = re.search(rb'boundary="?([^"\r\n;]+)"?', head, re.I)
+        if m:
+            delim = b"--" + m.group(1)
+    return delim
+
+
+def _read_part_headers(rd: _Reader) -> dict:
+    headers = {}
+    while True:
+        line = rd.readline()
+        if not line:
+            break
+        if not line.strip():
+            rd.buf = rd.buf[len(line):]          # línea en blanco: fin de cabeceras
+            break
+        if not _HEADER_LINE.match(line):
+            break                                 # sin línea en blanco: el cuerpo empieza aquí
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+        rd.buf = rd.buf[len(line):]
+    return headers
+
+
+def _part_filename(headers: dict, idx: int) -> str:
+    m = re.search(r'filename="?([^"\r\n;]+)"?', headers.get("content-disposition", ""), re.I)
+    cid = headers.get("content-id", "").strip().strip("<>")
+    fn = (m.group(1).strip() if m else None) or cid or f"attachment_{idx}.pdf"
+    fn = os.path.basename(fn)
+    if not fn.lower().endswith(".pdf"): fn += ".pdf"
+    return fn
+
+
+def _part_boundary(content_type: str):
+    m = re.search(r'boundary="?([^";]+)"?', content_type, re.I)
+    return b"--" + m.group(1).strip().encode("latin-1") if m else None
+
+
+def _trim_body_end(body: bytes, closing: bool) -> bytes:
+    """
+    Quita del final del cuerpo el salto de línea que pertenece a la frontera (uno solo).
+    Con la frontera de cierre se tolera el "----boundary--" de requestWithPdfAttachment.xml
+    (un "--" extra justo antes de la frontera).
+    """
+    if closing and body.endswith(b"\n--"):
+        body = body[:-2]
+    if body.endswith(b"\r\n"):
+        return body[:-2]
+    if body.endswith(b"\n"):
+        return body[:-1]
+    return body
+
+
+def _walk_parts(rd: _Reader, delim: bytes, out_dir: str, cxml_path, saved: list, idx: int) -> int:
+    """
+    Recorre las partes delimitadas por `delim` desde la posición actual de `rd`.
+    Las partes multipart/* anidadas se recorren con su propio boundary=.
+    Devuelve el siguiente índice para nombres de PDF sin filename/Content-ID.
+    """
+    hold = len(delim) + 4
+
+    # Preámbulo: hasta la primera frontera
+    while True:
+        i = rd.buf.find(delim)
+        if i >= 0:
+            rd.buf = rd.buf[i + len(delim):]
+            break
+        rd.buf = rd.buf[-hold:]
+        if not rd.fill():
+            return idx
+
+    while True:
+        while len(rd.buf) < 2 and rd.fill():
+            pass
+        if rd.buf.startswith(b"--"):
+            rd.buf = rd.buf[2:]
+            break                             # frontera de cierre
+        line = rd.readline()
+        rd.buf = rd.buf[len(line):]           # resto de la línea de la frontera
+        headers = _read_part_headers(rd)
+        full_ctype = headers.get("content-type", "")
+        ctype = full_ctype.split(";")[0].strip().lower()
+        b64 = "base64" in headers.get("content-transfer-encoding", "").lower()
+
+        sink, kind = None, None
+        if ctype.startswith("multipart/"):
+            inner = _part_boundary(full_ctype)
+            if inner and inner != delim:
+                idx = _walk_parts(rd, inner, out_dir, cxml_path, saved, idx)
+            # lo que quede (epílogo de la parte anidada) se descarta abajo
+        elif ctype == "application/pdf":
+            fn = _part_filename(headers, idx)
+            sink, kind = _Sink(os.path.join(out_dir, fn), b64), "pdf"
+        elif cxml_path and ctype in ("text/xml", "application/xml"):
+            sink, kind = _Sink(cxml_path, b64), "cxml"
+
+        # Cuerpo: se entrega por bloques reteniendo `hold` bytes por si la frontera queda partida
+        while True:
+            i = rd.buf.find(delim)
+            if i >= 0:
+                while len(rd.buf) < i + len(delim) + 2 and rd.fill():
+                    pass
+                body, rd.buf = rd.buf[:i], rd.buf[i + len(delim):]
+                if sink:
+                    sink.write(_trim_body_end(body, closing=rd.buf.startswith(b"--")))
+                break
+            if rd.eof:
+                body, rd.buf = rd.buf, b""
+                if sink:
+                    sink.write(body)
+                break
+            if len(rd.buf) > hold:
+                if sink:
+                    sink.write(rd.buf[:-hold])
+                rd.buf = rd.buf[-hold:]
+            rd.fill()
+
+        if sink:
+            rec = sink.close()
+            if rec["size"]:
+                rec.update(kind=kind, content_id=headers.get("content-id", "").strip().strip("<>"),
+                           filename=os.path.basename(rec["path"]))
+                saved.append(rec)
+                if kind == "pdf":
+                    idx += 1
+            else:
+                os.remove(rec["path"])
+        if not rd.buf and rd.eof:
+            break
+    return idx
+
+
+def stream_extract(src, out_dir: str, cxml_path: str = None, chunk_size: int = CHUNK_SIZE):
+    """
+    Extrae los PDF de un mensaje multipart (cXML + adjuntos) leyendo por bloques:
+    las fronteras se detectan sobre el buffer y el base64 se decodifica de forma
+    incremental directo a disco. Las partes multipart/* anidadas se recorren con su
+    propio boundary. Si se indica `cxml_path`, la parte text/xml se guarda ahí.
+    `src`: ruta o archivo binario abierto.
+    Devuelve [{"kind", "content_id", "filename", "path", "size", "sha256"}] por parte guardada.
+    """
+    f = open(src, "rb") if isinstance(src, (str, os.PathLike)) else src
+    try:
+        rd = _Reader(f, chunk_size)
+        while len(rd.buf) < 8192 and rd.fill():
+            pass
+        delim = _find_boundary(rd.buf[:8192])
+        if not delim:
+            return []
+        saved = []
+        _walk_parts(rd, delim, out_dir, cxml_path, saved, 1)
+        return saved
+    finally:
+        if f is not src:
+            f.close()
+
+
+# ---------------------------------------------------------------------------
+# Lote: directorio o glob de mensajes, en paralelo, con deduplicado por sha256
+# ---------------------------------------------------------------------------
+
+MANIFEST_FIELDS = ["message", "kind", "content_id", "path", "size", "sha256", "duplicate"]
+
+
+def _expand_sources(src: str):
+    if os.path.isdir(src):
+        return sorted(p for p in (os.path.join(src, n) for n in os.listdir(src)) if os.path.isfile(p))
+    return sorted(p for p in glob.glob(src) if os.path.isfile(p))
+
+
+def _file_record(path: str, kind: str = "pdf", content_id: str = "") -> dict:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return {"kind": kind, "content_id": content_id, "filename": os.path.basename(path),
+            "path": path, "size": os.path.getsize(path), "sha256": sha.hexdigest()}
+
+
+def fallback_extract(src: str, out_dir: str) -> list:
+    """
+    Extractores en memoria para lo que stream_extract no reconoce (p.ej. un .eml no
+    multipart con el PDF como única parte). Mismo formato de registro que stream_extract.
+    """
     with open(src, "rb") as f:
         raw = f.read()
     saved = email_parse_extract(raw, out_dir) or manual_multipart_extract(raw, out_dir)
-    print(f"Guardados: {saved}" if saved else "No se encontraron PDFs.")
+    return [_file_record(p) for p in saved]
+
+
+def _cxml_output_path(out_dir: str, src: str) -> str:
+    # El sufijo de la ruta completa evita que a.xml / a.eml o homónimos de otro directorio se pisen
+    stem = os.path.splitext(os.path.basename(src))[0]
+    suffix = hashlib.sha256(os.path.abspath(src).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(out_dir, "cxml", f"{stem}_{suffix}.xml")
+
+
+def _extract_one(args):
+    i, src, out_dir = args
+    work = os.path.join(out_dir, "_tmp", f"{i:06d}")
+    try:
+        recs = stream_extract(src, work, cxml_path=_cxml_output_path(out_dir, src))
+        if not any(r["kind"] == "pdf" for r in recs):
+            recs += fallback_extract(src, work)
+        if not any(r["kind"] == "pdf" for r in recs):
+            return src, recs, "No se encontraron PDFs."
+        return src, recs, None
+    except Exception as e:
+        return src, [], str(e)
+
+
+def _load_manifest_hashes(manifest: str) -> dict:
+    known = {}
+    if os.path.isfile(manifest):
+        with open(manifest, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row.get("kind") == "pdf" and row.get("duplicate") != "1" and os.path.isfile(row.get("path", "")):
+                    known.setdefault(row["sha256"], row["path"])
+    return known
+
+
+def extract_batch(src: str, out_dir: str, workers: int = None, manifest: str = None):
+    """
+    Extrae PDFs y la parte cXML de cada mensaje de `src` (directorio o glob) con un
+    ProcessPoolExecutor. Los PDF idénticos (mismo sha256, también respecto a corridas
+    anteriores del manifiesto) se guardan una sola vez en <out_dir>/pdf.
+    Añade una fila por parte al manifiesto CSV (por defecto <out_dir>/manifest.csv).
+    """
+    sources = _expand_sources(src)
+    manifest = manifest or os.path.join(out_dir, "manifest.csv")
+    pdf_dir = os.path.join(out_dir, "pdf")
+    os.makedirs(pdf_dir, exist_ok=True)
+    known = _load_manifest_hashes(manifest)
+
+    rows, errors = [], []
+    jobs = [(i, s, out_dir) for i, s in enumerate(sources)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for msg, recs, err in pool.map(_extract_one, jobs, chunksize=16):
+            if err:
+                errors.append((msg, err))
+            for rec in recs:
+                dup = False
+                if rec["kind"] == "pdf":
+                    if rec["sha256"] in known:
+                        os.remove(rec["path"])
+                        rec["path"], dup = known[rec["sha256"]], True
+                    else:
+                        dest = os.path.join(pdf_dir, rec["filename"])
+                        if os.path.exists(dest):
+                            base, ext = os.path.splitext(rec["filename"])
+                            dest = os.path.join(pdf_dir, f"{base}_{rec['sha256'][:12]}{ext}")
+                        shutil.move(rec["path"], dest)
+                        rec["path"] = known[rec["sha256"]] = dest
+                rows.append({"message": msg, "kind": rec["kind"], "content_id": rec["content_id"],
+                             "path": rec["path"], "size": rec["size"], "sha256": rec["sha256"],
+                             "duplicate": "1" if dup else "0"})
+    shutil.rmtree(os.path.join(out_dir, "_tmp"), ignore_errors=True)
+
+    new_file = not os.path.isfile(manifest)
+    with open(manifest, "a", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        if new_file:
+            w.writeheader()
+        w.writerows(rows)
+    return rows, errors
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Extrae PDFs (y el cXML) de mensajes MIME multipart")
+    ap.add_argument("src", help="Mensaje, directorio o glob (p.ej. 'inbound/*.xml')")
+    ap.add_argument("out_dir", nargs="?", default="out")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos en modo lote (por defecto: núcleos)")
+    ap.add_argument("--manifest", default=None, help="CSV de salida del lote (por defecto <out_dir>/manifest.csv)")
+    args = ap.parse_args()
+    src, out_dir = args.src, args.out_dir
+
+    if os.path.isdir(src) or glob.has_magic(src):
+        rows, errors = extract_batch(src, out_dir, workers=args.workers, manifest=args.manifest)
+        pdfs = [r for r in rows if r["kind"] == "pdf"]
+        print(f"Mensajes con error: {len(errors)}")
+        for msg, err in errors:
+            print(f" - {msg}: {err}")
+        print(f"PDFs: {len(pdfs)} ({sum(r['duplicate'] == '1' for r in pdfs)} duplicados)")
+    else:
+        saved = [r["path"] for r in stream_extract(src, out_dir) if r["kind"] == "pdf"]
+        if not saved:
+            # Mensajes no multipart (p.ej. un .eml con el PDF como única parte)
+            saved = [r["path"] for r in fallback_extract(src, out_dir)]
+        print(f"Guardados: {saved}" if saved else "No se encontraron PDFs.")
 
 # Ejemplo de uso:
 # python extract_pdf_from_mime.py email.eml output_directory
+# python extract_pdf_from_mime.py inbound/ output_directory --workers 8
@@ -0,0 +1,160 @@
+# mime_package.py
+"""
+Empaquetado multipart/related de un cXML con sus PDF adjuntos (los `cid:` de las
+Extrinsic invoicePDF), en el formato de requestWithPdfAttachment.xml.
+
+El cuerpo no se arma en memoria: MultipartRelated es un iterable de bloques
+  - el cXML se copia del archivo por bloques
+  - cada PDF se mapea con mmap y se codifica en base64 por trozos de B64_CHUNK bytes
+    (múltiplo de 57 => líneas completas de 76 caracteres, sin arrastrar restos)
+y expone __len__ con la longitud exacta, así requests lo envía en streaming con
+Content-Length. En memoria nunca hay más de un trozo de un PDF.
+"""
+import argparse
+import binascii
+import glob
+import mmap
+import os
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Iterator, List, Optional, Tuple
+
+ATTACHMENT_DIR = os.environ.get("EXAMIN_ATTACHMENT_DIR", "./attachments")
+
+B64_LINE_BYTES = 57                       # 57 bytes -> 76 caracteres base64 (RFC 2045)
+B64_CHUNK = B64_LINE_BYTES * 1024 * 16    # ~912 KB de PDF por trozo
+FILE_CHUNK = 1024 * 1024
+CRLF = b"\r\n"
+
+
+def find_cid_references(xml_path: str) -> List[str]:
+    """Content-IDs referenciados como <Attachment><URL>cid:...</URL> (lectura incremental)."""
+    cids = []
+    for _, elem in ET.iterparse(xml_path, events=("end",)):
+        if elem.tag == "URL" and elem.text and elem.text.strip().lower().startswith("cid:"):
+            cid = elem.text.strip()[4:].strip("<>")
+            if cid and cid not in cids:
+                cids.append(cid)
+        elem.clear()
+    return cids
+
+
+def resolve_attachments(xml_path: str, attachment_dir: str = ATTACHMENT_DIR) -> List[Tuple[str, str]]:
+    """[(content_id, ruta del PDF)] para cada cid: del cXML con archivo <attachment_dir>/<cid>.pdf."""
+    found = []
+    for cid in find_cid_references(xml_path):
+        path = os.path.join(attachment_dir, cid if cid.lower().endswith(".pdf") else f"{cid}.pdf")
+        if os.path.isfile(path):
+            found.append((cid, path))
+    return found
+
+
+def _b64_len(n: int) -> int:
+    """Longitud del base64 con líneas de 76 + CRLF (la última línea también termina en CRLF)."""
+    if n == 0:
+        return 0
+    lines = (n + B64_LINE_BYTES - 1) // B64_LINE_BYTES
+    return 4 * ((n + 2) // 3) + 2 * lines
+
+
+def _b64_lines(data) -> bytes:
+    enc = binascii.b2a_base64(data, newline=False)
+    return CRLF.join(enc[i:i + 76] for i in range(0, len(enc), 76)) + CRLF
+
+
+class MultipartRelated:
+    """Cuerpo multipart/related (cXML + PDFs) generado en streaming."""
+
+    def __init__(self, xml_path: str, attachments: List[Tuple[str, str]], boundary: Optional[str] = None):
+        self.xml_path = xml_path
+        self.attachments = attachments
+        self.boundary = boundary or f"cxml-{uuid.uuid4().hex}"
+        self.start_cid = f"{os.path.splitext(os.path.basename(xml_path))[0]}.cxml@examin"
+
+    @property
+    def content_type(self) -> str:
+        return (f'multipart/related; boundary="{self.boundary}"; '
+                f'type="text/xml"; start="<{self.start_cid}>"')
+
+    def _xml_headers(self) -> bytes:
+        return (f"--{self.boundary}\r\n"
+                "Content-Type: text/xml; charset=UTF-8\r\n"
+                f"Content-ID: <{self.start_cid}>\r\n\r\n").encode("ascii")
+
+    def _pdf_headers(self, cid: str, path: str) -> bytes:
+        return (f"\r\n--{self.boundary}\r\n"
+                "Content-Type: application/pdf\r\n"
+                "Content-Transfer-Encoding: base64\r\n"
+                f"Content-ID: <{cid}>\r\n"
+                f"Content-Disposition: attachment; filename={os.path.basename(path)}\r\n\r\n").encode("utf-8")
+
+    def _closing(self) -> bytes:
+        return f"\r\n--{self.boundary}--\r\n".encode("ascii")
+
+    def __len__(self) -> int:
+        total = len(self._xml_headers()) + os.path.getsize(self.xml_path) + len(self._closing())
+        for cid, path in self.attachments:
+            total += len(self._pdf_headers(cid, path)) + _b64_len(os.path.getsize(path))
+        return total
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._xml_headers()
+        with open(self.xml_path, "rb") as f:
+            while True:
+                chunk = f.read(FILE_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+
+        for cid, path in self.attachments:
+            yield self._pdf_headers(cid, path)
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        for off in range(0, size, B64_CHUNK):
+                            yield _b64_lines(view[off:off + B64_CHUNK])
+                    finally:
+                        view.release()
+        yield self._closing()
+
+    def write_to(self, out_path: str) -> str:
+        """Vuelca el mensaje completo a `out_path` (mismo contenido que se envía)."""
+        with open(out_path, "wb") as f:
+            for chunk in self:
+                f.write(chunk)
+        return out_path
+
+
+def package_cxml(xml_path: str, attachment_dir: str = ATTACHMENT_DIR) -> Optional[MultipartRelated]:
+    """MultipartRelated si el cXML referencia PDFs presentes en `attachment_dir`; si no, None."""
+    attachments = resolve_attachments(xml_path, attachment_dir)
+    return MultipartRelated(xml_path, attachments) if attachments else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Empaqueta cXML + PDF adjuntos como multipart/related")
+    ap.add_argument("src", help="cXML o directorio con los cXML generados (p.ej. salida/)")
+    ap.add_argument("--attach-dir", default=ATTACHMENT_DIR, help="Directorio con los PDF (<cid>.pdf)")
+    ap.add_argument("--out", default=None, help="Directorio de los .mime (por defecto junto a cada cXML)")
+    args = ap.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.src, "*.xml"))) if os.path.isdir(args.src) else [args.src]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    for xml_path in paths:
+        package = package_cxml(xml_path, args.attach_dir)
+        if package is None:
+            print(f"{xml_path}: sin adjuntos")
+            continue
+        out_dir = args.out or os.path.dirname(xml_path)
+        out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(xml_path))[0] + ".mime")
+        package.write_to(out_path)
+        print(f"{xml_path}: {len(package.attachments)} adjunto(s) -> {out_path} ({len(package)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,23 +8,38 @@ Guarda CSVs y opcionalmente imprime un resumen.
 
 Uso:
   python parse_cxml_to_dfs.py --input path/al/archivo.xml --outdir ./salida --print
+  python parse_cxml_to_dfs.py --input grande.xml --outdir ./salida --stream   # iterparse, memoria plana
+  python parse_cxml_to_dfs.py --input salida/ --outdir ./conciliacion --workers 8  # lote: directorio o glob
+
+En modo lote se escribe un único dataset header/items/summary con las columnas
+payloadID, invoiceID y source_file como clave, en Parquet (o Arrow IPC con
+--format arrow) si está pyarrow; si no, CSV.
 
 Requisitos:
   - Python 3.8+
   - pandas (pip install pandas)
+  - pyarrow (opcional, salida Parquet / Arrow IPC)
 """
 
 from __future__ import annotations
 
 import argparse
+import glob
 import os
 import sys
 import json
-from typing import Dict, Any, List, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Any, List, Tuple, Optional
 import xml.etree.ElementTree as ET
 
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # salida columnar opcional; sin pyarrow se escribe CSV
+    pa = None
+
 
 def _text(el: Optional[ET.Element]) -> str:
     return (el.text or "").strip() if el is not None else ""
@@ -34,6 +49,37 @@ def _attr(el: Optional[ET.Element], name: str) -> str:
     return el.get(name, "") if el is not None else ""
 
 
+def _iter_path(el: Optional[ET.Element], tags: Tuple[str, ...]):
+    """Como el.iterfind("A/B/C") con tags=("A","B","C"), sin pasar por ElementPath."""
+    if el is None:
+        return
+    if not tags:
+        yield el
+        return
+    head, rest = tags[0], tags[1:]
+    for child in el:
+        if child.tag == head:
+            yield from _iter_path(child, rest)
+
+
+def _find_path(el: Optional[ET.Element], tags: Tuple[str, ...]) -> Optional[ET.Element]:
+    """Como el.find("A/B/C"): primer match en orden de documento."""
+    return next(_iter_path(el, tags), None)
+
+
+# Rutas precompiladas (tuplas de tags) usadas por parse_header / parse_items / parse_summary
+_P_CORRESPONDENT_NAME = ("Correspondent", "Contact", "Name")
+_P_REQUEST_HEADER = ("Request", "InvoiceDetailRequest", "InvoiceDetailRequestHeader")
+_P_ORDERS = ("Request", "InvoiceDetailRequest", "InvoiceDetailOrder")
+_P_ORDER_ID_INFO = ("InvoiceDetailOrderInfo", "OrderIDInfo")
+_P_SUMMARY = ("Request", "InvoiceDetailRequest", "InvoiceDetailSummary")
+_P_ATTACHMENT_URL = ("Attachment", "URL")
+_P_SUBTOTAL_MONEY = ("SubtotalAmount", "Money")
+_P_NET_MONEY = ("NetAmount", "Money")
+_P_TAXABLE_MONEY = ("TaxableAmount", "Money")
+_P_TAX_AMOUNT_MONEY = ("TaxAmount", "Money")
+
+
 def parse_header(root: ET.Element) -> Dict[str, Any]:
     # Top-level attributes
     data: Dict[str, Any] = {
@@ -46,17 +92,24 @@ def parse_header(root: ET.Element) -> Dict[str, Any]:
     if header is None:
         return data
 
+    # Una pasada sobre los hijos de Header; las columnas se emiten siempre From, To, Sender
+    from_el = to_el = sender = None
+    for child in header:
+        if child.tag == "From" and from_el is None:
+            from_el = child
+        elif child.tag == "To" and to_el is None:
+            to_el = child
+        elif child.tag == "Sender" and sender is None:
+            sender = child
+
     # From
-    from_el = header.find("From")
     if from_el is not None:
         cred = from_el.find("Credential")
         data["from_credential_domain"] = _attr(cred, "domain")
         data["from_identity"] = _text(cred.find("Identity")) if cred is not None else ""
-        corr = from_el.find("Correspondent/Contact/Name")
-        data["from_correspondent_name"] = _text(corr)
+        data["from_correspondent_name"] = _text(_find_path(from_el, _P_CORRESPONDENT_NAME))
 
     # To (puede haber varios Credential)
-    to_el = header.find("To")
     if to_el is not None:
         creds = to_el.findall("Credential")
         for i, c in enumerate(creds, start=1):
@@ -64,7 +117,6 @@ def parse_header(root: ET.Element) -> Dict[str, Any]:
             data[f"to_credential{i}_identity"] = _text(c.find("Identity"))
 
     # Sender
-    sender = header.find("Sender")
     if sender is not None:
         cred = sender.find("Credential")
         data["sender_credential_domain"] = _attr(cred, "domain")
@@ -79,14 +131,28 @@ def parse_header(root: ET.Element) -> Dict[str, Any]:
         data["request_deploymentMode"] = _attr(req, "deploymentMode")
 
     # InvoiceDetailRequestHeader
-    idr = root.find("Request/InvoiceDetailRequest/InvoiceDetailRequestHeader")
+    idr = _find_path(root, _P_REQUEST_HEADER)
     if idr is not None:
         # attributes
         for att in ("invoiceDate", "invoiceID", "invoiceOrigin", "operation", "purpose"):
             data[f"header_{att}"] = _attr(idr, att)
 
+        # Una pasada sobre los hijos: partners, PaymentTerm, Comments, Extrinsic
+        partners: List[ET.Element] = []
+        extrinsics: List[ET.Element] = []
+        pterm = comments = None
+        for child in idr:
+            tag = child.tag
+            if tag == "InvoicePartner":
+                partners.append(child)
+            elif tag == "Extrinsic":
+                extrinsics.append(child)
+            elif tag == "PaymentTerm" and pterm is None:
+                pterm = child
+            elif tag == "Comments" and comments is None:
+                comments = child
+
         # partners
-        partners = idr.findall("InvoicePartner")
         for i, p in enumerate(partners, start=1):
             contact = p.find("Contact")
             role = _attr(contact, "role")
@@ -100,16 +166,15 @@ def parse_header(root: ET.Element) -> Dict[str, Any]:
             data[f"partner{i}_email"] = email
 
         # payment term + comments
-        pterm = idr.find("PaymentTerm")
         data["paymentTerm_days"] = _attr(pterm, "payInNumberOfDays")
-        data["comments"] = _text(idr.find("Comments"))
+        data["comments"] = _text(comments)
 
         # Extrinsics -> volcar como columnas extrinsic_<name> = value (o URL si es attachment)
-        for ex in idr.findall("Extrinsic"):
+        for ex in extrinsics:
             ex_name = _attr(ex, "name").strip() or "unnamed"
             value = _text(ex)
             # Si hay Attachment/URL preferimos ese valor
-            url_el = ex.find("Attachment/URL")
+            url_el = _find_path(ex, _P_ATTACHMENT_URL)
             if url_el is not None and _text(url_el):
                 value = _text(url_el)
             data[f"extrinsic_{ex_name}"] = value
@@ -117,64 +182,95 @@ def parse_header(root: ET.Element) -> Dict[str, Any]:
     return data
 
 
+def _item_row(it: ET.Element, order_id: str) -> Dict[str, Any]:
+    """
+    Una sola pasada sobre los hijos del InvoiceDetailItem. Cada campo se queda con el
+    primer match en orden de documento, igual que it.find("A/B"), sin recorrer el
+    subárbol una vez por campo (Distribution/Accounting/AccountingSegment se visita una vez).
+    """
+    uom = m_price = ref = ref_desc = m_sub = None
+    acc_seg = seg_name = seg_desc = m_charge = None
+    for child in it:
+        tag = child.tag
+        if tag == "UnitOfMeasure":
+            if uom is None:
+                uom = child
+        elif tag == "UnitPrice":
+            if m_price is None:
+                m_price = child.find("Money")
+        elif tag == "InvoiceDetailItemReference":
+            if ref is None:
+                ref = child
+            if ref_desc is None:
+                ref_desc = child.find("Description")
+        elif tag == "SubtotalAmount":
+            if m_sub is None:
+                m_sub = child.find("Money")
+        elif tag == "Distribution":
+            # Distribution (opcional)
+            for part in child:
+                if part.tag == "Accounting":
+                    for seg in part:
+                        if seg.tag != "AccountingSegment":
+                            continue
+                        if acc_seg is None:
+                            acc_seg = seg
+                        if seg_name is None:
+                            seg_name = seg.find("Name")
+                        if seg_desc is None:
+                            seg_desc = seg.find("Description")
+                elif part.tag == "Charge" and m_charge is None:
+                    m_charge = part.find("Money")
+
+    row: Dict[str, Any] = {"order_id": order_id}
+    row["invoiceLineNumber"] = _attr(it, "invoiceLineNumber")
+    row["quantity"] = _attr(it, "quantity")
+    row["unitOfMeasure"] = _text(uom)
+    row["unitPrice"] = _text(m_price)
+    row["unitPrice_currency"] = _attr(m_price, "currency")
+    row["ref_lineNumber"] = _attr(ref, "lineNumber")
+    row["description"] = _text(ref_desc)
+    row["subtotal"] = _text(m_sub)
+    row["subtotal_currency"] = _attr(m_sub, "currency")
+    row["dist_accounting_id"] = _attr(acc_seg, "id")
+    row["dist_accounting_name"] = _text(seg_name)
+    row["dist_accounting_desc"] = _text(seg_desc)
+    if m_charge is not None:
+        row["dist_charge_amount"] = _text(m_charge)
+        row["dist_charge_currency"] = _attr(m_charge, "currency")
+        row["dist_charge_alt_amount"] = _attr(m_charge, "alternateAmount")
+        row["dist_charge_alt_currency"] = _attr(m_charge, "alternateCurrency")
+    return row
+
+
 def parse_items(root: ET.Element) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
     # Puede haber múltiples InvoiceDetailOrder
-    for order in root.findall("Request/InvoiceDetailRequest/InvoiceDetailOrder"):
-        order_info = order.find("InvoiceDetailOrderInfo/OrderIDInfo")
-        order_id = _attr(order_info, "orderID") if order_info is not None else ""
+    for order in _iter_path(root, _P_ORDERS):
+        order_info = _find_path(order, _P_ORDER_ID_INFO)
+        order_id = _attr(order_info, "orderID")
 
         for it in order.findall("InvoiceDetailItem"):
-            row: Dict[str, Any] = {"order_id": order_id}
-            row["invoiceLineNumber"] = _attr(it, "invoiceLineNumber")
-            row["quantity"] = _attr(it, "quantity")
-
-            row["unitOfMeasure"] = _text(it.find("UnitOfMeasure"))
-
-            m_price = it.find("UnitPrice/Money")
-            row["unitPrice"] = _text(m_price)
-            row["unitPrice_currency"] = _attr(m_price, "currency") if m_price is not None else ""
-
-            ref = it.find("InvoiceDetailItemReference")
-            row["ref_lineNumber"] = _attr(ref, "lineNumber") if ref is not None else ""
-            row["description"] = _text(it.find("InvoiceDetailItemReference/Description"))
-
-            m_sub = it.find("SubtotalAmount/Money")
-            row["subtotal"] = _text(m_sub)
-            row["subtotal_currency"] = _attr(m_sub, "currency") if m_sub is not None else ""
-
-            # Distribution (opcional)
-            acc_seg = it.find("Distribution/Accounting/AccountingSegment")
-            row["dist_accounting_id"] = _attr(acc_seg, "id") if acc_seg is not None else ""
-            row["dist_accounting_name"] = _text(it.find("Distribution/Accounting/AccountingSegment/Name"))
-            row["dist_accounting_desc"] = _text(it.find("Distribution/Accounting/AccountingSegment/Description"))
-            m_charge = it.find("Distribution/Charge/Money")
-            if m_charge is not None:
-                row["dist_charge_amount"] = _text(m_charge)
-                row["dist_charge_currency"] = _attr(m_charge, "currency")
-                row["dist_charge_alt_amount"] = _attr(m_charge, "alternateAmount")
-                row["dist_charge_alt_currency"] = _attr(m_charge, "alternateCurrency")
-
-            items.append(row)
+            items.append(_item_row(it, order_id))
 
     return items
 
 
 def parse_summary(root: ET.Element) -> Dict[str, Any]:
     summary: Dict[str, Any] = {}
-    s = root.find("Request/InvoiceDetailRequest/InvoiceDetailSummary")
+    s = _find_path(root, _P_SUMMARY)
     if s is None:
         return summary
 
-    m_sub = s.find("SubtotalAmount/Money")
+    m_sub = _find_path(s, _P_SUBTOTAL_MONEY)
     summary["subtotal"] = _text(m_sub)
-    summary["subtotal_currency"] = _attr(m_sub, "currency") if m_sub is not None else ""
+    summary["subtotal_currency"] = _attr(m_sub, "currency")
 
     tax = s.find("Tax")
     if tax is not None:
         m_tax = tax.find("Money")
         summary["tax_total"] = _text(m_tax)
-        summary["tax_currency"] = _attr(m_tax, "currency") if m_tax is not None else ""
+        summary["tax_currency"] = _attr(m_tax, "currency")
         summary["tax_description"] = _text(tax.find("Description"))
 
         tdet = tax.find("TaxDetail")
@@ -182,21 +278,37 @@ def parse_summary(root: ET.Element) -> Dict[str, Any]:
             summary["tax_category"] = _attr(tdet, "category")
             summary["tax_percentageRate"] = _attr(tdet, "percentageRate")
 
-            m_txbl = tdet.find("TaxableAmount/Money")
+            m_txbl = _find_path(tdet, _P_TAXABLE_MONEY)
             summary["tax_taxable_amount"] = _text(m_txbl)
-            summary["tax_taxable_currency"] = _attr(m_txbl, "currency") if m_txbl is not None else ""
+            summary["tax_taxable_currency"] = _attr(m_txbl, "currency")
 
-            m_tamt = tdet.find("TaxAmount/Money")
+            m_tamt = _find_path(tdet, _P_TAX_AMOUNT_MONEY)
             summary["tax_amount"] = _text(m_tamt)
-            summary["tax_amount_currency"] = _attr(m_tamt, "currency") if m_tamt is not None else ""
+            summary["tax_amount_currency"] = _attr(m_tamt, "currency")
 
-    m_net = s.find("NetAmount/Money")
+    m_net = _find_path(s, _P_NET_MONEY)
     summary["net_amount"] = _text(m_net)
-    summary["net_currency"] = _attr(m_net, "currency") if m_net is not None else ""
+    summary["net_currency"] = _attr(m_net, "currency")
 
     return summary
 
 
+ITEM_COLUMNS = [
+    "order_id","invoiceLineNumber","quantity","unitOfMeasure","unitPrice","unitPrice_currency",
+    "ref_lineNumber","description","subtotal","subtotal_currency","dist_accounting_id",
+    "dist_accounting_name","dist_accounting_desc","dist_charge_amount","dist_charge_currency",
+    "dist_charge_alt_amount","dist_charge_alt_currency"
+]
+
+
+def _to_dfs(header_dict: Dict[str, Any], items_list: List[Dict[str, Any]],
+            summary_dict: Dict[str, Any]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    df_header = pd.DataFrame([header_dict])
+    df_items = pd.DataFrame(items_list) if items_list else pd.DataFrame(columns=ITEM_COLUMNS)
+    df_summary = pd.DataFrame([summary_dict]) if summary_dict else pd.DataFrame()
+    return df_header, df_items, df_summary
+
+
 def parse_cxml(xml_path: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Devuelve (df_header, df_items, df_summary)."""
     tree = ET.parse(xml_path)
@@ -206,31 +318,194 @@ def parse_cxml(xml_path: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
     items_list = parse_items(root)
     summary_dict = parse_summary(root)
 
-    df_header = pd.DataFrame([header_dict])
-    df_items = pd.DataFrame(items_list) if items_list else pd.DataFrame(columns=[
-        "order_id","invoiceLineNumber","quantity","unitOfMeasure","unitPrice","unitPrice_currency",
-        "ref_lineNumber","description","subtotal","subtotal_currency","dist_accounting_id",
-        "dist_accounting_name","dist_accounting_desc","dist_charge_amount","dist_charge_currency",
-        "dist_charge_alt_amount","dist_charge_alt_currency"
-    ])
-    df_summary = pd.DataFrame([summary_dict]) if summary_dict else pd.DataFrame()
-
-    return df_header, df_items, df_summary
+    return _to_dfs(header_dict, items_list, summary_dict)
+
+
+# Ramas que parse_header/parse_summary necesitan; el resto se descarta al cerrarse
+_KEEP_UNDER = {
+    ("cXML",): {"Header", "Request"},
+    ("cXML", "Request"): {"InvoiceDetailRequest"},
+    ("cXML", "Request", "InvoiceDetailRequest"): {"InvoiceDetailRequestHeader", "InvoiceDetailSummary"},
+}
+_ORDER_PATH = ("cXML", "Request", "InvoiceDetailRequest", "InvoiceDetailOrder")
+
+
+def iterparse_cxml(xml_path: str, on_item: Callable[[Dict[str, Any]], None]) -> ET.Element:
+    """
+    Recorre el cXML con iterparse: llama `on_item(row)` por cada InvoiceDetailItem en
+    cuanto se cierra y lo elimina del árbol, igual que las ramas que no se usan
+    (InvoiceDetailOrder ya procesados, ds:Signature, ...).
+    Devuelve la raíz reducida (Header, InvoiceDetailRequestHeader, InvoiceDetailSummary),
+    suficiente para parse_header y parse_summary. Memoria ~constante en nº de líneas.
+    """
+    stack: List[ET.Element] = []
+    path: List[str] = []
+    order_id = ""
+    root = None
+
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            stack.append(elem)
+            path.append(elem.tag)
+            if tuple(path) == _ORDER_PATH:
+                order_id = ""
+            continue
+
+        parent_path = tuple(path[:-1])
+        parent = stack[-2] if len(stack) > 1 else None
+
+        if parent_path == _ORDER_PATH:
+            if elem.tag == "InvoiceDetailItem":
+                on_item(_item_row(elem, order_id))
+                parent.remove(elem)
+            elif elem.tag == "InvoiceDetailOrderInfo" and not order_id:
+                order_info = elem.find("OrderIDInfo")
+                order_id = _attr(order_info, "orderID") if order_info is not None else ""
+        elif parent is not None and parent_path in _KEEP_UNDER and elem.tag not in _KEEP_UNDER[parent_path]:
+            parent.remove(elem)
+
+        stack.pop()
+        path.pop()
+
+    return root
+
+
+def parse_cxml_stream(xml_path: str) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Igual que parse_cxml pero con iterparse (archivos grandes): mismos DataFrames."""
+    items_list: List[Dict[str, Any]] = []
+    root = iterparse_cxml(xml_path, items_list.append)
+    return _to_dfs(parse_header(root), items_list, parse_summary(root))
+
+
+# ---------------------------------------------------------------------------
+# Modo lote: muchos cXML -> un dataset consolidado
+# ---------------------------------------------------------------------------
+
+KEY_COLUMNS = ["payloadID", "invoiceID", "source_file"]
+FORMAT_EXT = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def _expand_inputs(src: str) -> List[str]:
+    if os.path.isdir(src):
+        return sorted(os.path.join(src, n) for n in os.listdir(src)
+                      if n.lower().endswith(".xml") and os.path.isfile(os.path.join(src, n)))
+    return sorted(p for p in glob.glob(src) if os.path.isfile(p))
+
+
+def _parse_one(job: Tuple[str, bool]):
+    """Worker: (ruta, stream) -> (ruta, header, items, summary, error). Dicts, no DataFrames (pickle barato)."""
+    path, stream = job
+    try:
+        if stream:
+            items: List[Dict[str, Any]] = []
+            root = iterparse_cxml(path, items.append)
+        else:
+            root = ET.parse(path).getroot()
+            items = parse_items(root)
+        header, summary = parse_header(root), parse_summary(root)
+    except Exception as e:
+        return path, None, [], None, str(e)
+
+    key = {"payloadID": header.get("payloadID", ""),
+           "invoiceID": header.get("header_invoiceID", ""),
+           "source_file": os.path.basename(path)}
+    header = {**key, **header}
+    items = [{**key, **row} for row in items]
+    summary = {**key, **summary} if summary else None
+    return path, header, items, summary, None
+
+
+def parse_batch(paths: List[str], workers: Optional[int] = None, stream: bool = False,
+                chunksize: int = 16) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, List[Tuple[str, str]]]:
+    """
+    Parsea `paths` en un ProcessPool y consolida (df_header, df_items, df_summary, errores).
+    Las tres tablas llevan KEY_COLUMNS al principio; los errores no cortan el lote.
+    """
+    headers: List[Dict[str, Any]] = []
+    items: List[Dict[str, Any]] = []
+    summaries: List[Dict[str, Any]] = []
+    errors: List[Tuple[str, str]] = []
+
+    jobs = [(p, stream) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, header, rows, summary, err in pool.map(_parse_one, jobs, chunksize=chunksize):
+            if err:
+                errors.append((path, err))
+                continue
+            headers.append(header)
+            items.extend(rows)
+            if summary:
+                summaries.append(summary)
+
+    df_header = pd.DataFrame(headers, columns=None if headers else KEY_COLUMNS)
+    df_items = pd.DataFrame(items) if items else pd.DataFrame(columns=KEY_COLUMNS + ITEM_COLUMNS)
+    df_summary = pd.DataFrame(summaries) if summaries else pd.DataFrame(columns=KEY_COLUMNS)
+    return df_header, df_items, df_summary, errors
+
+
+def resolve_format(fmt: str) -> str:
+    """'auto' -> parquet si hay pyarrow, si no csv. Parquet/arrow sin pyarrow caen a csv con aviso."""
+    if fmt == "auto":
+        return "parquet" if pa is not None else "csv"
+    if fmt in ("parquet", "arrow") and pa is None:
+        print(f"[WARN] pyarrow no instalado: se escribe CSV en lugar de {fmt}", file=sys.stderr)
+        return "csv"
+    return fmt
+
+
+def write_dataset(df: pd.DataFrame, path_no_ext: str, fmt: str) -> str:
+    path = path_no_ext + FORMAT_EXT[fmt]
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    elif fmt == "arrow":
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), path)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def run_batch(args) -> int:
+    paths = _expand_inputs(args.input)
+    if not paths:
+        print(f"[ERROR] Sin archivos .xml en {args.input}", file=sys.stderr)
+        return 1
+
+    fmt = resolve_format(args.format)
+    df_header, df_items, df_summary, errors = parse_batch(paths, workers=args.workers, stream=args.stream)
+    for path, err in errors:
+        print(f"[ERROR] {path}: {err}", file=sys.stderr)
+
+    print(f"{len(paths) - len(errors)}/{len(paths)} cXML parseados: "
+          f"{len(df_header)} cabeceras, {len(df_items)} líneas, {len(df_summary)} resúmenes")
+    print(f"Dataset ({fmt}) generado:")
+    for name, df in (("cxml_header", df_header), ("cxml_items", df_items), ("cxml_summary", df_summary)):
+        print(" -", write_dataset(df, os.path.join(args.outdir, name), fmt))
+    return 1 if errors else 0
 
 
 def main():
     ap = argparse.ArgumentParser(description="Parse cXML InvoiceDetail a DataFrames / CSVs")
-    ap.add_argument("--input", required=True, help="Ruta del archivo cXML")
+    ap.add_argument("--input", required=True, help="Archivo cXML, o directorio/glob para modo lote")
     ap.add_argument("--outdir", default=".", help="Directorio de salida para CSVs")
     ap.add_argument("--print", action="store_true", help="Imprimir preview en consola")
+    ap.add_argument("--stream", action="store_true", help="Lectura incremental (iterparse) para archivos grandes")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos en modo lote (por defecto: núcleos)")
+    ap.add_argument("--format", choices=["auto", "parquet", "arrow", "csv"], default="auto",
+                    help="Formato del dataset en modo lote (auto: parquet si hay pyarrow, si no csv)")
     args = ap.parse_args()
 
     in_path = args.input
     outdir = args.outdir
     os.makedirs(outdir, exist_ok=True)
 
+    if os.path.isdir(in_path) or glob.has_magic(in_path):
+        sys.exit(run_batch(args))
+
     try:
-        df_header, df_items, df_summary = parse_cxml(in_path)
+        parse = parse_cxml_stream if args.stream else parse_cxml
+        df_header, df_items, df_summary = parse(in_path)
     except Exception as e:
         print(f"[ERROR] No se pudo parsear el XML: {e}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del proyecto son planos en la raíz del repo
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
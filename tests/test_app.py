@@ -0,0 +1,98 @@
+import app
+
+
+def _result(invoice_id, status_code, error=None):
+    return {"invoice_id": invoice_id, "path": f"{invoice_id}.xml", "status_code": status_code,
+            "text": "", "error": error}
+
+
+def test_failed_sends_counts_http_failures_without_recorded_status():
+    results = [_result(1, 201), _result(2, 200), _result(3, 503), _result(4, 400)]
+    assert [r["invoice_id"] for r in app.failed_sends(results)] == [3, 4]
+
+
+def test_failed_sends_ignores_406_recorded_as_error():
+    # 406 queda como ERROR en good_to_pay (snapshot_filter la excluye): no frena la marca de agua
+    assert app.failed_sends([_result(1, 201), _result(2, 406)]) == []
+
+
+def test_recordable_results_marks_sent_and_rejected():
+    results = [_result(1, 201), _result(2, 406), _result(3, 503), _result(4, None, error="timeout"),
+               _result(5, 200), _result(5, 500)]
+    recorded = [(r["invoice_id"], r["status_code"]) for r in app.recordable_results(results)]
+    # 5 tiene una hoja sin estado: no se marca SENT para que se vuelva a seleccionar
+    assert recorded == [(1, 201), (2, 406)]
+
+
+def test_failed_sends_counts_transport_errors():
+    assert app.failed_sends([_result(1, None, error="timeout")])
+    assert app.failed_sends([_result(1, 201)]) == []
+
+
+def test_iter_load_data_skips_null_keys(tmp_path, monkeypatch):
+    import sqlalchemy as sa
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'gtp.db'}")
+    with engine.begin() as con:
+        con.execute(sa.text("CREATE TABLE good_to_pay (invoice_id INTEGER, amount REAL)"))
+        con.execute(sa.text("INSERT INTO good_to_pay VALUES (:i, :a)"),
+                    [{"i": i, "a": a} for i, a in [(None, 1.0), (1, 2.0), (1, 3.0), (2, 4.0),
+                                                   (None, 5.0), (3, 6.0), (3, 7.0)]])
+    monkeypatch.setattr(app, "get_connection", lambda db: engine)
+
+    chunks = list(app.iter_load_data("good_to_pay", schema=None, columns=["invoice_id", "amount"], chunksize=2))
+
+    seen = [sorted(c["invoice_id"].astype(int).unique().tolist()) for c in chunks]
+    assert sum(seen, []) == [1, 2, 3]                     # cada factura en un único bloque
+    assert sum(len(c) for c in chunks) == 5               # las filas sin invoice_id no se entregan
+
+
+def test_collapse_status_rows_error_wins_over_sent():
+    rows = [app._status_row(10, 201, "ok", None),
+            app._status_row(10, 406, "rechazada hoja 2", None),
+            app._status_row(10, 406, "rechazada hoja 3", None),
+            app._status_row(11, 200, "ok", None),
+            app._status_row(11.0, 201, "ok", None)]
+    collapsed = app._collapse_status_rows(rows)
+    assert [(r["invoice_id"], r["status"], r["description"]) for r in collapsed] == [
+        (10, "ERROR", "rechazada hoja 2"),
+        (11, "SENT", "ok"),
+    ]
+
+
+def test_dump_xml_does_not_modify_caller_tree():
+    import xml.etree.ElementTree as ET
+
+    root = ET.fromstring("<cXML><Header><From>a</From></Header></cXML>")
+    before = ET.tostring(root)
+    out = app.dump_xml(root, include_doctype=False)
+    assert ET.tostring(root) == before
+    assert b"\n  <Header>" in out
+
+
+def test_positive_int_rejects_zero():
+    import argparse
+
+    import pytest
+
+    assert app._positive_int("3") == 3
+    with pytest.raises(argparse.ArgumentTypeError):
+        app._positive_int("0")
+
+
+def test_send_xml_files_sends_every_path_of_an_invoice(monkeypatch, tmp_path):
+    sent = []
+
+    class _Resp:
+        status_code, text = 201, "ok"
+
+    def fake_send(path, url, session=None, **kwargs):
+        sent.append(path)
+        return _Resp()
+
+    monkeypatch.setattr(app, "send_xml_file", fake_send)
+    pairs = [(7, str(tmp_path / "7.xml")), (7, str(tmp_path / "7_2.xml")), (8, str(tmp_path / "8.xml"))]
+    results = app.send_xml_files(pairs, url="http://example.invalid", max_in_flight=2)
+
+    assert sorted(sent) == sorted(p for _, p in pairs)
+    assert [(r["invoice_id"], r["path"]) for r in results] == pairs
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "api"))
+
+
+def _import_asgi_app():
+    # api/app.py y api/db.py tienen el mismo nombre que los módulos de la raíz
+    shadowed = {name: sys.modules.pop(name) for name in ("app", "db") if name in sys.modules}
+    sys.path.insert(0, API_DIR)
+    try:
+        return pytest.importorskip("asgi_app")
+    finally:
+        sys.path.remove(API_DIR)
+        for name in ("app", "db"):
+            sys.modules.pop(name, None)
+        sys.modules.update(shadowed)
+
+
+asgi_app = _import_asgi_app()
+
+
+@pytest.mark.parametrize("body", [b"[1]", b'"x"', b"3", b"{no json"])
+def test_send_status_rejects_non_object_json(body):
+    status, payload = asyncio.run(asgi_app.send_status(body))
+    assert status == 400
+    assert b"Bad Request" in payload
+
+
+def test_send_status_empty_body_is_406():
+    status, _ = asyncio.run(asgi_app.send_status(b""))
+    assert status == 406
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import os
+
+import extract_pdf_from_mime as ex
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PDF = b"%PDF-1.4\n binario \x00\xff\r\n%%EOF--\r\n"
+
+
+def _write(tmp_path, name, raw: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(raw)
+    return str(path)
+
+
+def test_binary_part_keeps_trailing_dashes_and_newlines(tmp_path):
+    raw = (b"--XBOUNDARY01\r\n"
+           b"Content-Type: application/pdf\r\n"
+           b"Content-Disposition: attachment; filename=a.pdf\r\n\r\n"
+           + PDF + b"\r\n--XBOUNDARY01--\r\n")
+    recs = ex.stream_extract(_write(tmp_path, "m.eml", raw), str(tmp_path / "out"), chunk_size=7)
+    assert [r["size"] for r in recs] == [len(PDF)]
+    assert recs[0]["sha256"] == hashlib.sha256(PDF).hexdigest()
+
+
+def test_nested_multipart_is_followed(tmp_path):
+    b64 = base64.encodebytes(PDF)
+    raw = (b'Content-Type: multipart/mixed; boundary="OUTER0001"\r\n\r\n'
+           b"--OUTER0001\r\n"
+           b"Content-Type: text/plain\r\n\r\nhola\r\n"
+           b"--OUTER0001\r\n"
+           b'Content-Type: multipart/mixed; boundary="INNER0001"\r\n\r\n'
+           b"--INNER0001\r\n"
+           b"Content-Type: application/pdf\r\n"
+           b"Content-Transfer-Encoding: base64\r\n"
+           b"Content-ID: <inv1>\r\n\r\n" + b64 +
+           b"\r\n--INNER0001--\r\n"
+           b"\r\n--OUTER0001--\r\n")
+    recs = ex.stream_extract(_write(tmp_path, "n.eml", raw), str(tmp_path / "out"))
+    assert [(r["content_id"], r["sha256"]) for r in recs] == [("inv1", hashlib.sha256(PDF).hexdigest())]
+
+
+def test_sample_closing_boundary_quirk(tmp_path):
+    src = os.path.join(REPO, "requestWithPdfAttachment.xml")
+    raw = open(src, "rb").read()
+    expected = ex.email_parse_extract(raw, str(tmp_path / "ref")) or ex.manual_multipart_extract(raw, str(tmp_path / "ref"))
+    recs = ex.stream_extract(src, str(tmp_path / "out"))
+    pdfs = [r for r in recs if r["kind"] == "pdf"]
+    assert len(pdfs) == len(expected) == 1
+    assert pdfs[0]["sha256"] == hashlib.sha256(open(expected[0], "rb").read()).hexdigest()
+
+
+def test_batch_fallback_and_unique_cxml_names(tmp_path):
+    inbox = tmp_path / "in"
+    inbox.mkdir()
+    part = (b"--XBOUNDARY01\r\nContent-Type: text/xml\r\n\r\n<cXML n='%d'/>\r\n"
+            b"--XBOUNDARY01\r\nContent-Type: application/pdf\r\n"
+            b"Content-Disposition: attachment; filename=a.pdf\r\n\r\n%%PDF-%d\r\n--XBOUNDARY01--\r\n")
+    (inbox / "a.xml").write_bytes(part % (1, 1))
+    (inbox / "a.eml").write_bytes(part % (2, 2))
+    # .eml no multipart: solo lo encuentran los extractores en memoria
+    (inbox / "single.eml").write_bytes(b"Content-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n"
+                                       b"Content-Disposition: attachment; filename=s.pdf\r\n\r\n"
+                                       + base64.encodebytes(PDF))
+    (inbox / "nopdf.eml").write_bytes(b"Subject: hola\r\n\r\nsin adjuntos\r\n")
+
+    out = tmp_path / "out"
+    rows, errors = ex.extract_batch(str(inbox), str(out), workers=2)
+
+    cxml_paths = [r["path"] for r in rows if r["kind"] == "cxml"]
+    assert len(cxml_paths) == len(set(cxml_paths)) == 2
+    assert sorted(open(p, "rb").read() for p in cxml_paths) == [b"<cXML n='1'/>", b"<cXML n='2'/>"]
+    pdf_msgs = sorted(os.path.basename(r["message"]) for r in rows if r["kind"] == "pdf")
+    assert pdf_msgs == ["a.eml", "a.xml", "single.eml"]
+    assert [(os.path.basename(m), e) for m, e in errors] == [("nopdf.eml", "No se encontraron PDFs.")]
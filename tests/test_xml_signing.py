@@ -0,0 +1,45 @@
+import base64
+import hashlib
+import xml.etree.ElementTree as ET
+
+import pytest
+
+xml_signing = pytest.importorskip("xml_signing")
+from lxml import etree  # noqa: E402  (xml_signing ya exige lxml)
+
+import app  # noqa: E402
+from bench_signing import make_test_key  # noqa: E402
+
+NS = xml_signing.NSMAP
+
+
+def _signed_doc(tmp_path):
+    cxml = ET.Element("cXML", attrib={"payloadID": "PID"})
+    request = ET.SubElement(cxml, "Request", attrib={"Id": app.SIGNED_DATA_ID})
+    ET.SubElement(request, "InvoiceDetailRequest").text = "x"
+    cxml.append(app._signature_for("PID"))
+    key_path, cert_path = make_test_key(str(tmp_path), bits=1024)
+    key = xml_signing.load_signing_key(key_path)
+    cert_b64 = xml_signing.load_certificate_b64(cert_path)
+    return xml_signing.sign_bytes(ET.tostring(cxml), key, cert_b64), key, cert_b64
+
+
+def test_cxmldata_reference_is_the_request_element(tmp_path):
+    signed, key, _ = _signed_doc(tmp_path)
+    root = etree.fromstring(signed)
+    ref = root.find("ds:Signature/ds:SignedInfo/ds:Reference[@URI='#cXMLData']", NS)
+    request_c14n = etree.tostring(root.find("Request"), method="c14n")
+    assert ref.find("ds:DigestValue", NS).text == base64.b64encode(hashlib.sha256(request_c14n).digest()).decode()
+    assert xml_signing.verify_bytes(signed, key.public_key())
+
+
+def test_signing_certificate_matches_supplied_certificate(tmp_path):
+    signed, _, cert_b64 = _signed_doc(tmp_path)
+    cert = etree.fromstring(signed).find(".//xades:SigningCertificate/xades:Cert", NS)
+    der = base64.b64decode(cert_b64)
+    assert cert.find("xades:CertDigest/ds:DigestValue", NS).text == \
+        base64.b64encode(hashlib.sha256(der).digest()).decode()
+    assert cert.find("xades:IssuerSerial/ds:X509IssuerName", NS).text == "CN=examin-bench"
+    from cryptography import x509
+    assert cert.find("xades:IssuerSerial/ds:X509SerialNumber", NS).text == \
+        str(x509.load_der_x509_certificate(der).serial_number)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+xml_signing.py
+
+Firma XMLDSig/XAdES de los cXML generados por app.py (bloque <ds:Signature> de
+_signature_template). Rellena los DigestValue, el SignatureValue y el X509Certificate
+con valores calculados sobre el documento en lugar de los textos fijos de la plantilla.
+
+  - Canonicalización: C14N 1.0 inclusiva (la declarada en CanonicalizationMethod).
+  - Digest: SHA-256 de cada Reference, resuelta por Id como cualquier verificador XMLDSig:
+        #cXMLSignedInfo   -> elemento <cXMLSignedInfo Id="cXMLSignedInfo">
+        #cXMLData         -> <Request Id="cXMLData"> (el payload, como en Sample cXML/)
+        #XAdESSignedProps -> <xades:SignedProperties Id="XAdESSignedProps">
+  - Con certificado: X509Certificate y el SigningCertificate de XAdES (CertDigest,
+    IssuerSerial) se calculan a partir de él antes de los digests.
+  - Firma: RSA-SHA256 (PKCS#1 v1.5) sobre <ds:SignedInfo> canonicalizado.
+
+La clave privada se lee y parsea una sola vez por proceso (load_signing_key) y,
+en lote, una vez por worker del pool (sign_files).
+
+Uso:
+  python xml_signing.py --key clave.pem --cert cert.pem salida/*.xml
+
+Requisitos:
+  - lxml
+  - cryptography (pip install cryptography)
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography import x509
+
+
+NS_DS    = "http://www.w3.org/2000/09/xmldsig#"
+NS_XADES = "http://uri.etsi.org/01903/v1.3.2#"
+NSMAP    = {"ds": NS_DS, "xades": NS_XADES}
+
+XML_DECL = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+_PARSER = etree.XMLParser(load_dtd=False, no_network=True, resolve_entities=False, huge_tree=True)
+
+
+# ---------------------------------------------------------------------------
+# Clave y certificado (una vez por proceso)
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=8)
+def load_signing_key(key_path: str, password: Optional[bytes] = None):
+    """Clave privada RSA en PEM; se parsea una sola vez por (ruta, password) y proceso."""
+    with open(key_path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=password)
+
+
+@lru_cache(maxsize=8)
+def load_certificate_b64(cert_path: str) -> str:
+    """Certificado X.509 (PEM o DER) en base64 DER, tal como va en <ds:X509Certificate>."""
+    with open(cert_path, "rb") as f:
+        data = f.read()
+    cert = x509.load_pem_x509_certificate(data) if b"-----BEGIN" in data else x509.load_der_x509_certificate(data)
+    return base64.b64encode(cert.public_bytes(serialization.Encoding.DER)).decode("ascii")
+
+
+@lru_cache(maxsize=8)
+def _cert_properties(cert_b64: str) -> Dict[str, str]:
+    """CertDigest (SHA-256 del DER, base64), X509IssuerName y X509SerialNumber de un certificado."""
+    der = base64.b64decode(cert_b64)
+    cert = x509.load_der_x509_certificate(der)
+    return {
+        "digest": base64.b64encode(hashlib.sha256(der).digest()).decode("ascii"),
+        "issuer": cert.issuer.rfc4514_string(),
+        "serial": str(cert.serial_number),
+    }
+
+
+def _set_signing_certificate(signature, cert_b64: str):
+    """Escribe el certificado en KeyInfo y en xades:SigningCertificate (dentro de SignedProperties)."""
+    cert_el = signature.find("ds:KeyInfo/ds:X509Data/ds:X509Certificate", NSMAP)
+    if cert_el is not None:
+        cert_el.text = cert_b64
+
+    cert_ref = signature.find(".//xades:SignedProperties//xades:SigningCertificate/xades:Cert", NSMAP)
+    if cert_ref is None:
+        return
+    props = _cert_properties(cert_b64)
+    method = cert_ref.find("xades:CertDigest/ds:DigestMethod", NSMAP)
+    if method is not None:
+        method.set("Algorithm", "http://www.w3.org/2001/04/xmlenc#sha256")
+    fields = {
+        "xades:CertDigest/ds:DigestValue": props["digest"],
+        "xades:IssuerSerial/ds:X509IssuerName": props["issuer"],
+        "xades:IssuerSerial/ds:X509SerialNumber": props["serial"],
+    }
+    for path, value in fields.items():
+        el = cert_ref.find(path, NSMAP)
+        if el is not None:
+            el.text = value
+
+
+# ---------------------------------------------------------------------------
+# Digests
+# ---------------------------------------------------------------------------
+
+def _c14n(elem) -> bytes:
+    return etree.tostring(elem, method="c14n", exclusive=False, with_comments=False)
+
+
+def _digest_b64(data: bytes) -> str:
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+def _by_id(root, id_value: str):
+    found = root.xpath("//*[@Id=$id]", id=id_value)
+    if not found:
+        raise ValueError(f"No existe ningún elemento con Id='{id_value}'")
+    return found[0]
+
+
+def _reference_target(root, signature, uri: str) -> bytes:
+    if uri.startswith("#"):
+        return _c14n(_by_id(root, uri[1:]))
+    raise ValueError(f"Reference URI no soportada: {uri!r}")
+
+
+# ---------------------------------------------------------------------------
+# Firma
+# ---------------------------------------------------------------------------
+
+def sign_document(root, key, cert_b64: Optional[str] = None) -> Dict[str, str]:
+    """
+    Firma in situ el árbol lxml `root` (<cXML> con su <ds:Signature>).
+    Devuelve {URI: DigestValue} de cada Reference más 'SignatureValue'.
+    """
+    signature = root.find("ds:Signature", NSMAP)
+    if signature is None:
+        raise ValueError("El documento no contiene <ds:Signature>")
+    signed_info = signature.find("ds:SignedInfo", NSMAP)
+
+    # El certificado entra en SignedProperties (firmado vía #XAdESSignedProps): se fija primero
+    if cert_b64 is not None:
+        _set_signing_certificate(signature, cert_b64)
+
+    # Los tres objetos referenciados viven fuera de SignedInfo: los digests no dependen entre sí
+    result: Dict[str, str] = {}
+    for ref in signed_info.findall("ds:Reference", NSMAP):
+        uri = ref.get("URI", "")
+        value = _digest_b64(_reference_target(root, signature, uri))
+        ref.find("ds:DigestValue", NSMAP).text = value
+        result[uri] = value
+
+    sig_bytes = key.sign(_c14n(signed_info), padding.PKCS1v15(), hashes.SHA256())
+    sig_value = base64.b64encode(sig_bytes).decode("ascii")
+    signature.find("ds:SignatureValue", NSMAP).text = sig_value
+    result["SignatureValue"] = sig_value
+    return result
+
+
+def sign_bytes(data: bytes, key, cert_b64: Optional[str] = None) -> bytes:
+    """Firma un cXML serializado y lo devuelve con la misma declaración y DOCTYPE."""
+    tree = etree.ElementTree(etree.fromstring(data, _PARSER))
+    sign_document(tree.getroot(), key, cert_b64)
+    doctype = tree.docinfo.doctype
+    out = XML_DECL
+    if doctype:
+        out += doctype.encode("utf-8") + b"\n"
+    return out + etree.tostring(tree.getroot(), encoding="utf-8")
+
+
+def verify_bytes(data: bytes, public_key) -> bool:
+    """Recalcula los digests y comprueba el SignatureValue con `public_key`."""
+    from cryptography.exceptions import InvalidSignature
+
+    root = etree.fromstring(data, _PARSER)
+    signature = root.find("ds:Signature", NSMAP)
+    signed_info = signature.find("ds:SignedInfo", NSMAP)
+    for ref in signed_info.findall("ds:Reference", NSMAP):
+        expected = ref.find("ds:DigestValue", NSMAP).text
+        if _digest_b64(_reference_target(root, signature, ref.get("URI", ""))) != expected:
+            return False
+    sig_value = base64.b64decode(signature.find("ds:SignatureValue", NSMAP).text or "")
+    try:
+        public_key.verify(sig_value, _c14n(signed_info), padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Lote (ProcessPoolExecutor, clave cargada una vez por worker)
+# ---------------------------------------------------------------------------
+
+# Estado de cada worker del pool (lo fija _init_signing_worker)
+_WORKER_KEY = None
+_WORKER_CERT = None
+
+def _init_signing_worker(key_path: str, cert_path: Optional[str], password: Optional[bytes]):
+    global _WORKER_KEY, _WORKER_CERT
+    _WORKER_KEY = load_signing_key(key_path, password)
+    _WORKER_CERT = load_certificate_b64(cert_path) if cert_path else None
+
+
+def sign_file(xml_path: str, out_path: Optional[str] = None, key=None, cert_b64: Optional[str] = None) -> str:
+    """Firma `xml_path` (en el sitio salvo que se indique `out_path`). Devuelve la ruta escrita."""
+    key = key if key is not None else _WORKER_KEY
+    if key is None:
+        raise RuntimeError("Sin clave de firma: usar load_signing_key o sign_files")
+    cert_b64 = cert_b64 if cert_b64 is not None else _WORKER_CERT
+
+    with open(xml_path, "rb") as f:
+        signed = sign_bytes(f.read(), key, cert_b64)
+    out_path = out_path or xml_path
+    with open(out_path, "wb") as f:
+        f.write(signed)
+    return out_path
+
+
+def _sign_chunk(paths: List[str], out_dir: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+    results = []
+    for path in paths:
+        out = os.path.join(out_dir, os.path.basename(path)) if out_dir else None
+        try:
+            results.append((sign_file(path, out), None))
+        except Exception as e:
+            results.append((path, str(e)))
+    return results
+
+
+def sign_files(xml_paths,
+               key_path: str,
+               cert_path: Optional[str] = None,
+               password: Optional[bytes] = None,
+               workers: Optional[int] = None,
+               chunk_size: int = 50,
+               out_dir: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+    """
+    Firma en paralelo una lista de cXML. Cada worker parsea la clave una sola vez.
+    Devuelve [(ruta escrita, error o None)] en el mismo orden que `xml_paths`.
+    """
+    paths = [str(p) for p in xml_paths]
+    chunk_size = max(1, chunk_size)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    if workers == 1 or len(chunks) <= 1:
+        _init_signing_worker(key_path, cert_path, password)
+        results = [_sign_chunk(chunk, out_dir) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 initializer=_init_signing_worker,
+                                 initargs=(key_path, cert_path, password)) as pool:
+            results = list(pool.map(_sign_chunk, chunks, repeat(out_dir)))
+
+    return [r for chunk in results for r in chunk]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Firma (XMLDSig/XAdES) archivos cXML generados")
+    ap.add_argument("paths", nargs="+", help="Archivos cXML a firmar")
+    ap.add_argument("--key", required=True, help="Clave privada RSA (PEM)")
+    ap.add_argument("--cert", default=None, help="Certificado X.509 (PEM/DER) para <ds:X509Certificate>")
+    ap.add_argument("--password", default=None, help="Password de la clave (si está cifrada)")
+    ap.add_argument("--workers", type=int, default=None, help="Procesos (por defecto: núcleos)")
+    ap.add_argument("--outdir", default=None, help="Directorio de salida (por defecto firma en el sitio)")
+    args = ap.parse_args()
+
+    password = args.password.encode("utf-8") if args.password else None
+    results = sign_files(args.paths, args.key, args.cert, password, workers=args.workers, out_dir=args.outdir)
+    errors = [(p, e) for p, e in results if e]
+    for p, e in errors:
+        print(f"[sign] {p}: {e}")
+    print(f"Firmados: {len(results) - len(errors)} / {len(results)}")
+
+
+if __name__ == "__main__":
+    main()